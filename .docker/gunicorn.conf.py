@@ -14,7 +14,7 @@ workers = int(os.getenv("WORKERS", str(multiprocessing.cpu_count() * 2)))
 # Each worker can handle many concurrent SSE clients (async)
 threads = 1
 
-# Graceful timeouts
+# Graceful timeouts (graceful_timeout must outlast SSE_DRAIN_SECONDS)
 graceful_timeout = 30
 timeout = 60
 keepalive = 65  # slightly > SSE heartbeat (20s)
@@ -27,9 +27,12 @@ loglevel = os.getenv("LOG_LEVEL", "info")
 # Preload the app for faster worker startup
 preload_app = True
 
-# Max requests per worker (avoid memory leaks, rotate periodically)
-max_requests = int(os.getenv("MAX_REQUESTS", "10000"))
-max_requests_jitter = int(os.getenv("MAX_REQUESTS_JITTER", "1000"))
+# Max requests per worker (avoid memory leaks, rotate periodically). Counted by the
+# app, which drains its SSE streams before exiting; gunicorn's own max_requests
+# would stop the worker with every stream still open
+os.environ.setdefault("WORKER_MAX_REQUESTS", os.getenv("MAX_REQUESTS", "10000"))
+os.environ.setdefault("WORKER_MAX_REQUESTS_JITTER", os.getenv("MAX_REQUESTS_JITTER", "1000"))
+max_requests = 0
 
 # Enable reuse of socket address
 reuse_port = True
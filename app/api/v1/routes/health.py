@@ -1,4 +1,8 @@
-from fastapi import APIRouter
+import asyncio
+from fastapi import APIRouter, Request, status
+from fastapi.responses import JSONResponse
+
+from app.core.config import settings
 
 
 
@@ -9,5 +13,29 @@ async def live():
     return {"status": "ok"}
 
 @router.get("/health/ready")
-async def ready():
-    return {"status": "ok"}
+async def ready(request: Request):
+    """
+    Ready when Redis (and every shard) answers and this worker can still take streams
+    (not full, not draining);
+    otherwise 503 so the load balancer routes new clients elsewhere.
+    """
+    checks = {}
+    try:
+        async with asyncio.timeout(settings.READINESS_REDIS_TIMEOUT_SECONDS):
+            await request.app.state.redis.ping()
+            # every shard carries a slice of the users, so all of them must answer
+            await asyncio.gather(*(c.ping() for c in request.app.state.shards.clients))
+        checks["redis"] = "ok"
+    except Exception:
+        checks["redis"] = "unavailable"
+
+    connections = request.app.state.connections
+    checks["connections"] = "full" if connections.at_capacity() else "ok"
+    checks["draining"] = "yes" if request.app.state.drainer.draining else "ok"
+
+    if any(v != "ok" for v in checks.values()):
+        return JSONResponse(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            content={"status": "unavailable", "checks": checks, "active_connections": connections.active},
+        )
+    return {"status": "ok", "checks": checks, "active_connections": connections.active}
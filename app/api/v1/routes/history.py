@@ -0,0 +1,38 @@
+import json
+from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, status
+from fastapi.responses import Response
+
+from app.core.config import settings
+from app.core.security import auth_required
+from app.auth.base import AuthContext
+
+
+
+router = APIRouter(tags=["external:history"])
+
+@router.get("/notify/history")
+async def history(
+    request: Request,
+    ctx: AuthContext = Depends(auth_required),
+    cursor: Optional[str] = Query(None, description="next_cursor from the previous page"),
+    limit: int = Query(50, ge=1, le=settings.HISTORY_MAX_PAGE_SIZE),
+):
+    """
+    Persistent events of the authenticated user, newest first.
+    Keyset-paginated on (user_id, id), so every page costs the same.
+    """
+    writer = request.app.state.persistence
+    if writer is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="History is disabled")
+
+    # one extra row tells us whether there is a next page
+    rows = await writer.backend.history(ctx.user_id, cursor, limit + 1)
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = json.loads(rows[-1])["id"]
+
+    # rows are stored envelope JSON; splice them in rather than re-serializing
+    body = '{"items":[' + ",".join(rows) + '],"next_cursor":' + json.dumps(next_cursor) + "}"
+    return Response(content=body, media_type="application/json")
@@ -0,0 +1,15 @@
+from fastapi import APIRouter, Depends, Request
+from fastapi.responses import PlainTextResponse
+
+from app.core.security import internal_trusted
+from app.services.metrics import registry
+
+
+
+router = APIRouter(tags=["metrics"])
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def metrics(request: Request, _: str = Depends(internal_trusted)):
+    """Prometheus exposition for every live worker, labelled by worker."""
+    snapshots = await request.app.state.metrics.collect()
+    return PlainTextResponse(registry.render(snapshots), media_type="text/plain; version=0.0.4")
@@ -1,35 +1,207 @@
-from fastapi import APIRouter, Depends, Request, status
+import time
+from typing import Any, List, Optional
+from fastapi import APIRouter, Body, Depends, Header, HTTPException, Request, status
 from fastapi.responses import JSONResponse
+from pydantic import ValidationError
 
 from app.api.v1.schemas import PublishRequest, EventEnvelope
 from app.core.security import internal_trusted
 from app.core.config import settings
-from app.services.pubsub import publish_event
+from app.services.idempotency import dedupe_key
+from app.services.metrics import (
+    PUBLISH_BATCH_SECONDS, PUBLISH_DUPLICATES, PUBLISH_RATE_LIMITED, PUBLISH_SECONDS, PUBLISH_SUMMARIZED,
+)
+from app.services.pubsub import event_channel, publish_event, publish_events
 from app.services.persistence import save_persistent_event
 from app.services.push_offline import send_push_notification_if_offline
-from app.utils.ids import new_event_id, now_iso
+from app.services.rate_limit import producer_bucket, retry_after_header, user_bucket
+from app.utils.ids import created_at_from_id, id_timestamp_ms, new_event_id
 
 
 
 router = APIRouter(tags=["internal:publish"])
 
-@router.post("/notify/publish")
-async def publish(req: PublishRequest, _: None = Depends(internal_trusted), request: Request = None):
-    envelope = EventEnvelope(
-        id=new_event_id(),
+def _envelope(req: PublishRequest) -> EventEnvelope:
+    event_id = new_event_id()
+    return EventEnvelope(
+        id=event_id,
         type=req.type,
-        user_id=str(req.user_id),
+        user_id=req.user_id,
+        topic=req.topic,
         data=req.data,
         permalink=req.permalink,
-        created_at=now_iso(),
+        created_at=created_at_from_id(event_id),
+        expires_at_ms=id_timestamp_ms(event_id) + req.ttl_ms if req.ttl_ms else None,
+        priority=req.priority,
     )
 
-    r = request.app.state.redis
-    await publish_event(r, envelope)
+def _duplicate(original: str) -> dict:
+    PUBLISH_DUPLICATES.inc()
+    return {"accepted": True, "id": original, "duplicate": True}
+
+async def _admit(request: Request, producer: str, envelopes: List[EventEnvelope]) -> List[Optional[float]]:
+    """
+    Rate limits events per target user and per producer: None for each event
+    that may go out, else the seconds until it could.
+    """
+    buckets = []
+    demand: dict = {}
+    for envelope in envelopes:
+        keys = [("producer", producer_bucket(producer))]
+        if envelope.user_id is not None:
+            keys.append(("user", user_bucket(envelope.user_id)))
+        buckets.append(keys)
+        for key in keys:
+            demand[key] = demand.get(key, 0) + 1
+    granted = await request.app.state.rate_limiter.take(demand)
+    left = {key: granted[key][0] for key in demand}
+
+    verdicts: List[Optional[float]] = []
+    for keys in buckets:
+        if all(left[key] > 0 for key in keys):
+            for key in keys:
+                left[key] -= 1
+            verdicts.append(None)
+        else:
+            verdicts.append(max(granted[key][1] for key in keys if left[key] <= 0))
+    return verdicts
+
+async def _over_limit(request: Request, envelope: EventEnvelope, persistent: bool) -> dict:
+    """Summarize mode: the event is folded into the target's next summary instead of delivered."""
+    request.app.state.summarizer.add(envelope)
+    PUBLISH_SUMMARIZED.inc()
+    # history stays complete; only live delivery and push are collapsed
+    if persistent:
+        await save_persistent_event(request.app.state.persistence, envelope)
+    return {"accepted": True, "id": envelope.id, "summarized": True}
+
+@router.post("/notify/publish")
+async def publish(
+    req: PublishRequest,
+    producer: str = Depends(internal_trusted),
+    request: Request = None,
+    idempotency_key: Optional[str] = Header(None, min_length=1, max_length=128),
+):
+    """
+    Publishes one event. With an idempotency key (the Idempotency-Key header or
+    the body field), a retry within the window publishes nothing and returns the
+    first event's id with "duplicate": true. Over the rate limit the event is
+    rejected with 429, or folded into a summary event (RATE_LIMIT_MODE=summarize).
+    """
+    started = time.perf_counter()
+    try:
+        envelope = _envelope(req)
+
+        key = req.idempotency_key or idempotency_key
+        dedupe = dedupe_key(event_channel(envelope), key) if key else None
+        cache = request.app.state.idempotency
+        original = cache.get(dedupe) if dedupe is not None else None
+        if original is None:
+            retry = (await _admit(request, producer, [envelope]))[0]
+            if retry is not None:
+                if settings.RATE_LIMIT_MODE == "summarize":
+                    content = await _over_limit(request, envelope, req.persistent)
+                    return JSONResponse(status_code=status.HTTP_202_ACCEPTED, content=content)
+                PUBLISH_RATE_LIMITED.inc()
+                raise HTTPException(
+                    status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                    detail="Rate limit exceeded",
+                    headers={"Retry-After": retry_after_header(retry)},
+                )
+            original = await publish_event(request.app.state.shards, envelope, dedupe)
+            if dedupe is not None:
+                cache.put(dedupe, original or envelope.id)
+        if original is not None:
+            return JSONResponse(status_code=status.HTTP_202_ACCEPTED, content=_duplicate(original))
+
+        if req.persistent:
+            await save_persistent_event(request.app.state.persistence, envelope)
+
+        await send_push_notification_if_offline(request.app.state.presence, envelope)
+
+        return JSONResponse(status_code=status.HTTP_202_ACCEPTED, content={"accepted": True, "id": envelope.id})
+    finally:
+        PUBLISH_SECONDS.observe(time.perf_counter() - started)
+
+@router.post("/notify/publish/batch")
+async def publish_batch(items: List[Any] = Body(...), producer: str = Depends(internal_trusted), request: Request = None):
+    """
+    Publishes a list of events through a single Redis pipeline.
+    Items are validated independently; the response carries one result per item, in order.
+    Items may carry an idempotency_key; settled are accepted with the original id.
+    Items over the rate limit are rejected with a retry_after, or summarized.
+    """
+    started = time.perf_counter()
+    try:
+        if len(items) > settings.PUBLISH_BATCH_MAX_ITEMS:
+            raise HTTPException(
+                status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                detail=f"Batch exceeds {settings.PUBLISH_BATCH_MAX_ITEMS} items"
+            )
+
+        results: List[dict] = [{}] * len(items)
+        cache = request.app.state.idempotency
+        valid: List[tuple[int, PublishRequest, EventEnvelope, Optional[str]]] = []
+        settled = 0
+        for i, item in enumerate(items):
+            try:
+                req = PublishRequest.model_validate(item)
+            except ValidationError as e:
+                results[i] = {"accepted": False, "error": e.errors(include_url=False, include_context=False)}
+                continue
+            envelope = _envelope(req)
+            dedupe = dedupe_key(event_channel(envelope), req.idempotency_key) if req.idempotency_key else None
+            original = cache.get(dedupe) if dedupe is not None else None
+            if original is not None:
+                results[i] = _duplicate(original)
+                settled += 1
+                continue
+            valid.append((i, req, envelope, dedupe))
+
+        verdicts = await _admit(request, producer, [envelope for _, _, envelope, _ in valid]) if valid else []
+        admitted = []
+        for item, retry in zip(valid, verdicts):
+            i, req, envelope, _ = item
+            if retry is None:
+                admitted.append(item)
+            elif settings.RATE_LIMIT_MODE == "summarize":
+                results[i] = await _over_limit(request, envelope, req.persistent)
+                settled += 1
+            else:
+                PUBLISH_RATE_LIMITED.inc()
+                retry_after = int(retry_after_header(retry))
+                results[i] = {"accepted": False, "error": "Rate limit exceeded", "retry_after": retry_after}
+        valid = admitted
+
+        outcomes = await publish_events(
+            request.app.state.shards,
+            [envelope for _, _, envelope, _ in valid],
+            [dedupe for _, _, _, dedupe in valid],
+        ) if valid else []
 
-    if req.persistent:
-        await save_persistent_event(envelope)
+        # one round trip for the presence of every target user
+        presence = request.app.state.presence
+        await presence.prefetch(envelope.user_id for _, _, envelope, _ in valid if envelope.user_id is not None)
 
-    await send_push_notification_if_offline(envelope)
+        accepted = settled
+        for (i, req, envelope, dedupe), outcome in zip(valid, outcomes):
+            if isinstance(outcome, Exception):
+                results[i] = {"accepted": False, "error": str(outcome)}
+                continue
+            accepted += 1
+            if dedupe is not None:
+                cache.put(dedupe, outcome or envelope.id)
+            if outcome is not None:
+                results[i] = _duplicate(outcome)
+                continue
+            results[i] = {"accepted": True, "id": envelope.id}
+            if req.persistent:
+                await save_persistent_event(request.app.state.persistence, envelope)
+            await send_push_notification_if_offline(presence, envelope)
 
-    return JSONResponse(status_code=status.HTTP_202_ACCEPTED, content={"accepted": True, "id": envelope.id})
+        return JSONResponse(
+            status_code=status.HTTP_202_ACCEPTED,
+            content={"accepted": accepted, "rejected": len(items) - accepted, "results": results},
+        )
+    finally:
+        PUBLISH_BATCH_SECONDS.observe(time.perf_counter() - started)
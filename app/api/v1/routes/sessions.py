@@ -0,0 +1,37 @@
+from typing import Optional
+from fastapi import APIRouter, Depends, Query, Request, status
+from fastapi.responses import JSONResponse
+
+from app.core.security import internal_trusted
+from app.utils.ids import worker_id
+
+
+
+router = APIRouter(tags=["internal:sessions"])
+
+@router.get("/notify/sessions/{user_id}")
+async def list_sessions(user_id: str, request: Request, _: str = Depends(internal_trusted)):
+    """
+    The user's open streams on the worker that answers, and with the cluster
+    registry (SSE_MAX_STREAMS_PER_USER_CLUSTER) on every live worker.
+    """
+    connections = request.app.state.connections
+    content = {
+        "user_id": user_id,
+        "worker": worker_id(),
+        "local": [s.describe() for s in connections.local_sessions(user_id)],
+    }
+    if connections.max_per_user_cluster:
+        content["cluster"] = await connections.cluster_sessions(user_id)
+    return content
+
+@router.delete("/notify/sessions/{user_id}")
+async def disconnect_sessions(
+    user_id: str,
+    request: Request,
+    _: str = Depends(internal_trusted),
+    session_id: Optional[str] = Query(None, description="Close only this session"),
+):
+    """Closes the user's streams on every worker; clients get a "closed" event first."""
+    closed = await request.app.state.connections.disconnect(user_id, session_id)
+    return JSONResponse(status_code=status.HTTP_202_ACCEPTED, content={"accepted": True, "closed_here": closed})
@@ -1,28 +1,250 @@
-from fastapi import APIRouter, Depends, Request
-from fastapi.responses import StreamingResponse
+import asyncio
+import contextlib
+import json
+import random
+from typing import List, Optional
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, WebSocket, WebSocketDisconnect, status
+from fastapi.exception_handlers import http_exception_handler
+from fastapi.requests import HTTPConnection
+from fastapi.responses import Response, StreamingResponse
+from redis.exceptions import RedisError
+from starlette.exceptions import HTTPException as StarletteHTTPException
 
+from app.core.config import settings
 from app.core.security import auth_required
 from app.auth.base import AuthContext
-from app.services.sse_manager import sse_event_stream
+from app.services.buffer import ConnectionBuffer
+from app.services.connections import CLOSED_EVENT_ID, DRAINING, SESSION_CLOSE_REASONS
+from app.services.compression import DICTIONARY, StreamCompressor, compress_stream, negotiate
+from app.services.metrics import WS_ACKS
+from app.services.pubsub import topic_channel
+from app.services.rate_limit import retry_after_header
+from app.services.sse_manager import control_frame, deliver, new_buffer, sse_event_stream, stream_channels
+from app.services.subscriber import ShardedSubscriber
 
 
 
 router = APIRouter(tags=["external:stream"])
 
+def _check_topics(topics: List[str], ctx: AuthContext, joined: int = 0) -> None:
+    if joined + len(topics) > settings.SSE_MAX_TOPICS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"At most {settings.SSE_MAX_TOPICS} topics per stream"
+        )
+    if settings.SSE_TOPICS_REQUIRE_SCOPE:
+        denied = [t for t in topics if t != settings.BROADCAST_TOPIC and f"topic:{t}" not in ctx.scopes]
+        if denied:
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail=f"Not allowed to subscribe to: {', '.join(denied)}"
+            )
+
+def _requested_topics(raw: Optional[str], ctx: AuthContext) -> List[str]:
+    topics = list(dict.fromkeys(t.strip() for t in (raw or "").split(",") if t.strip()))
+    _check_topics(topics, ctx)
+    return topics
+
+async def refuse_ws_handshake(conn: HTTPConnection, exc: StarletteHTTPException):
+    """
+    HTTPException handler: on a WebSocket handshake (auth, admission, topic
+    checks) it closes with 1013 for 503s and 1008 otherwise, instead of
+    leaving the handshake unanswered (logged as an ASGI error by the server).
+    """
+    if not isinstance(conn, WebSocket):
+        return await http_exception_handler(conn, exc)
+    code = status.WS_1013_TRY_AGAIN_LATER if exc.status_code == 503 else status.WS_1008_POLICY_VIOLATION
+    await conn.close(code=code, reason=str(exc.detail)[:120])
+
+def _admission_retry_after() -> str:
+    # jittered, so refused clients do not all come back in the same second
+    return str(random.randint(1, 2 * max(1, settings.SSE_ADMISSION_RETRY_AFTER_SECONDS)))
+
+async def stream_admission(conn: HTTPConnection) -> None:
+    # runs before auth, so a full or flooded worker rejects without paying for token checks
+    if conn.headers.get("last-event-id") == CLOSED_EVENT_ID:
+        # an evicted or admin-closed EventSource reconnecting: 204 stops it
+        raise HTTPException(status_code=status.HTTP_204_NO_CONTENT)
+    drainer = conn.app.state.drainer
+    if drainer.draining:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Worker shutting down",
+            headers={"Retry-After": retry_after_header(drainer.retry_ms() / 1000)},
+        )
+    if conn.app.state.connections.at_capacity():
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Worker at connection capacity",
+            headers={"Retry-After": _admission_retry_after()},
+        )
+    if not conn.app.state.stream_throttle.admit():
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many new streams",
+            headers={"Retry-After": _admission_retry_after()},
+        )
+
 @router.get("/notify/stream")
-async def stream(request: Request, ctx: AuthContext = Depends(auth_required)):
+async def stream(
+    request: Request,
+    _: None = Depends(stream_admission),
+    ctx: AuthContext = Depends(auth_required),
+    topics: Optional[str] = Query(None, description="Comma separated topics to join besides the user's own events"),
+):
     """
     SSE stream for the authenticated user.
     One connection per browser session recommended.
     """
     user_id = ctx.user_id
-    generator = sse_event_stream(request.app.state.redis, user_id, request)
-    return StreamingResponse(
-        generator,
-        media_type="text/event-stream",
-        headers={
-            "Cache-Control": "no-cache",
-            "Connection": "keep-alive",
-            "X-Accel-Buffering": "no",
-        },
+    # EventSource resends the last seen id on reconnect; the query form is for clients that open a new stream
+    last_event_id = request.headers.get("last-event-id") or request.query_params.get("lastEventId")
+    generator = sse_event_stream(
+        request.app.state.shards,
+        request.app.state.subscriber,
+        request.app.state.presence,
+        request.app.state.connections,
+        user_id,
+        request,
+        _requested_topics(topics, ctx),
+        last_event_id,
+    )
+    headers = {
+        "Cache-Control": "no-cache",
+        "Connection": "keep-alive",
+        "X-Accel-Buffering": "no",
+        "Vary": "Accept-Encoding",
+    }
+    encoding = negotiate(request.headers.get("accept-encoding"))
+    if encoding is not None:
+        generator = compress_stream(generator, StreamCompressor(encoding))
+        headers["Content-Encoding"] = encoding
+    return StreamingResponse(generator, media_type="text/event-stream", headers=headers)
+
+@router.get("/notify/stream/dictionary")
+async def stream_dictionary():
+    """Preset dictionary for the x-deflate-dict stream encoding."""
+    if not settings.SSE_COMPRESSION_DICTIONARY:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Dictionary encoding is disabled")
+    return Response(
+        DICTIONARY,
+        media_type="application/octet-stream",
+        headers={"Cache-Control": "public, max-age=86400"},
+    )
+
+async def _ws_op(
+    op: dict,
+    subscriber: ShardedSubscriber,
+    ctx: AuthContext,
+    buffer: ConnectionBuffer,
+    channels: set,
+) -> bytes | None:
+    kind = op.get("op")
+    if kind == "ack":
+        WS_ACKS.inc()
+        return None
+    if kind not in ("subscribe", "unsubscribe"):
+        raise ValueError(f"Unknown op: {kind}")
+
+    topics = op.get("topics")
+    if not isinstance(topics, list) or not all(isinstance(t, str) and t for t in topics):
+        raise ValueError("topics must be a list of names")
+    pinned = set(stream_channels(ctx.user_id))
+
+    if kind == "subscribe":
+        new = [t for t in dict.fromkeys(topics) if topic_channel(t) not in channels]
+        _check_topics(new, ctx, joined=len(channels - pinned))
+        for topic in new:
+            channel = topic_channel(topic)
+            # tracked before subscribing, so the stream's cleanup covers it either way
+            channels.add(channel)
+            await subscriber.subscribe(channel, buffer)
+        return control_frame("subscribed", {"topics": topics})
+
+    for topic in topics:
+        channel = topic_channel(topic)
+        if channel in channels and channel not in pinned:
+            channels.discard(channel)
+            await subscriber.unsubscribe(channel, buffer)
+    return control_frame("unsubscribed", {"topics": topics})
+
+async def _ws_reader(
+    websocket: WebSocket,
+    subscriber: ShardedSubscriber,
+    ctx: AuthContext,
+    buffer: ConnectionBuffer,
+    channels: set,
+) -> None:
+    """Handles upstream ops; replies go through the connection buffer, in order with events."""
+    while True:
+        message = await websocket.receive()
+        if message["type"] == "websocket.disconnect":
+            buffer.close("disconnected")
+            return
+        try:
+            op = json.loads(message.get("text") or message.get("bytes") or b"")
+            if not isinstance(op, dict):
+                raise ValueError("op must be a JSON object")
+            reply = await _ws_op(op, subscriber, ctx, buffer, channels)
+        except ValueError as e:
+            reply = control_frame("error", {"detail": str(e)})
+        except HTTPException as e:
+            reply = control_frame("error", {"detail": e.detail})
+        except RedisError:
+            reply = control_frame("error", {"detail": "Subscription temporarily unavailable"})
+        if reply is not None:
+            buffer.put_nowait(reply)
+
+@router.websocket("/notify/ws")
+async def ws(
+    websocket: WebSocket,
+    _: None = Depends(stream_admission),
+    ctx: AuthContext = Depends(auth_required),
+    topics: Optional[str] = Query(None, description="Comma separated topics to join besides the user's own events"),
+):
+    """
+    WebSocket transport for clients behind proxies that buffer SSE. Runs the
+    same delivery pipeline as /notify/stream: each text message carries one or
+    more SSE-framed events, so clients share one parser. Upstream JSON ops:
+    ``{"op": "subscribe" | "unsubscribe", "topics": [...]}`` and ``{"op": "ack", "id": ...}``.
+    """
+    state = websocket.app.state
+    buffer = new_buffer()
+    channels = set(stream_channels(ctx.user_id, _requested_topics(topics, ctx)))
+    await websocket.accept()
+
+    chunks = deliver(
+        state.shards,
+        state.subscriber,
+        state.presence,
+        state.connections,
+        ctx.user_id,
+        buffer,
+        channels,
+        websocket.query_params.get("lastEventId"),
+        transport="ws",
     )
+    reader: asyncio.Task | None = None
+    try:
+        async for chunk in chunks:
+            await websocket.send_text(chunk.decode())
+            if reader is None:
+                # after the ready frame, once the initial channels are subscribed
+                reader = asyncio.create_task(_ws_reader(websocket, state.subscriber, ctx, buffer, channels))
+    except (WebSocketDisconnect, OSError):
+        # the client went away mid-send
+        buffer.close("disconnected")
+    finally:
+        if reader is not None:
+            reader.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await reader
+        await chunks.aclose()
+
+    if buffer.closed_reason == "overflow":
+        # the resume hint went out last; reconnect with lastEventId to catch up
+        await websocket.close(code=status.WS_1013_TRY_AGAIN_LATER, reason="slow-consumer")
+    elif buffer.closed_reason == DRAINING:
+        await websocket.close(code=status.WS_1012_SERVICE_RESTART, reason=DRAINING)
+    elif buffer.closed_reason in SESSION_CLOSE_REASONS:
+        await websocket.close(code=status.WS_1000_NORMAL_CLOSURE, reason=buffer.closed_reason)
@@ -1,19 +1,40 @@
-from typing import Any, Optional
-from pydantic import BaseModel, Field
+from typing import Any, Literal, Optional
+from pydantic import BaseModel, Field, model_validator
 
 
 
 class PublishRequest(BaseModel):
-    type: str = Field(..., min_length=1, max_length=64)
-    user_id: str = Field(..., min_length=1)
+    # no line breaks: the type is written verbatim into the SSE "event:" line
+    type: str = Field(..., min_length=1, max_length=64, pattern=r"^[^\r\n]+$")
+    # exactly one target: a single user, or a topic fanned out to its subscribers
+    user_id: Optional[str] = Field(None, min_length=1)
+    topic: Optional[str] = Field(None, min_length=1, max_length=128, pattern=r"^[A-Za-z0-9_.:-]+$")
     data: Any
     permalink: Optional[str] = None
     persistent: bool = False
+    # retries with the same key (per target) within the window return the first event's id
+    idempotency_key: Optional[str] = Field(None, min_length=1, max_length=128)
+    # live delivery only: dropped instead of written once ttl_ms has passed;
+    # "high" skips ahead of a connection's pending backlog
+    ttl_ms: Optional[int] = Field(None, ge=1, le=86_400_000)
+    priority: Literal["normal", "high"] = "normal"
+
+    @model_validator(mode="after")
+    def _check_target(self):
+        if (self.user_id is None) == (self.topic is None):
+            raise ValueError("exactly one of user_id or topic is required")
+        if self.persistent and self.user_id is None:
+            raise ValueError("persistent events require a user_id")
+        return self
 
 class EventEnvelope(BaseModel):
     id: str
     type: str
-    user_id: str
+    user_id: Optional[str] = None
     data: Any
     permalink: Optional[str] = None
     created_at: str
+    topic: Optional[str] = None
+    # delivery hints, not part of the event clients receive
+    expires_at_ms: Optional[int] = Field(None, exclude=True)
+    priority: Literal["normal", "high"] = Field("normal", exclude=True)
@@ -1,6 +1,6 @@
 from dataclasses import dataclass
 from typing import List, Optional
-from fastapi import Request
+from fastapi.requests import HTTPConnection
 
 
 
@@ -10,5 +10,6 @@ class AuthContext:
     scopes: List[str]
 
 class AuthBackend:
-    async def authenticate(self, request: Request) -> AuthContext:
+    async def authenticate(self, conn: HTTPConnection) -> AuthContext:
+        """Works for both HTTP requests and WebSocket handshakes."""
         raise NotImplementedError
@@ -1,9 +1,14 @@
+import hashlib
+import time
 import jwt
-from typing import List
-from fastapi import Request, HTTPException, status
+from collections import OrderedDict
+from typing import Dict, List, Tuple
+from fastapi import HTTPException, status
+from fastapi.requests import HTTPConnection
 
 from app.auth.base import AuthBackend, AuthContext
 from app.core.config import settings
+from app.services.metrics import AUTH_FAILURES
 
 
 
@@ -13,23 +18,47 @@ class JWTAuthBackend(AuthBackend):
         self.secret = settings.JWT_SECRET
         self.user_claim = settings.JWT_USER_ID_CLAIM
 
-    async def authenticate(self, request: Request) -> AuthContext:
-        token = request.query_params.get("token")
+        # Verified tokens: sha256(token) -> (context, expires_at). LRU-bounded;
+        # entries expire at the token's exp (capped), so hits skip the crypto safely.
+        self.cache_size = settings.JWT_CACHE_SIZE
+        self.cache_max_ttl = settings.JWT_CACHE_MAX_TTL_SECONDS
+        self._cache: "OrderedDict[bytes, Tuple[AuthContext, float]]" = OrderedDict()
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def cache_stats(self) -> Dict[str, int]:
+        return {"hits": self.cache_hits, "misses": self.cache_misses, "size": len(self._cache)}
+
+    async def authenticate(self, conn: HTTPConnection) -> AuthContext:
+        token = conn.query_params.get("token")
 
         if not token:
-            auth = request.headers.get("Authorization", "")
+            auth = conn.headers.get("Authorization", "")
             if auth.startswith("Bearer "):
                 token = auth.removeprefix("Bearer ").strip()
 
         if not token:
+            AUTH_FAILURES.inc()
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="Missing token"
             )
 
+        digest = hashlib.sha256(token.encode()).digest()
+        now = time.time()
+        cached = self._cache.get(digest)
+        if cached is not None:
+            if cached[1] > now:
+                self._cache.move_to_end(digest)
+                self.cache_hits += 1
+                return cached[0]
+            del self._cache[digest]
+        self.cache_misses += 1
+
         try:
             payload = jwt.decode(token, self.secret, algorithms=[self.alg])
         except jwt.PyJWTError:
+            AUTH_FAILURES.inc()
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="Invalid token"
@@ -37,10 +66,21 @@ class JWTAuthBackend(AuthBackend):
 
         user_id = payload.get(self.user_claim)
         if not user_id:
+            AUTH_FAILURES.inc()
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="Invalid user claim"
             )
 
         scopes: List[str] = payload.get("scopes", [])
-        return AuthContext(user_id=str(user_id), scopes=scopes)
+        ctx = AuthContext(user_id=str(user_id), scopes=scopes)
+
+        if self.cache_size > 0:
+            expires_at = now + self.cache_max_ttl
+            exp = payload.get("exp")
+            if isinstance(exp, (int, float)):
+                expires_at = min(expires_at, exp)
+            self._cache[digest] = (ctx, expires_at)
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return ctx
@@ -1,7 +1,13 @@
 import os
 from typing import List
+from pydantic import field_validator
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
+from app.services.buffer import POLICIES
+
+
+
+RATE_LIMIT_MODES = ("reject", "summarize")
 
 
 class Settings(BaseSettings):
@@ -9,6 +15,10 @@ class Settings(BaseSettings):
     API_V1_PREFIX: str = os.getenv("API_V1_PREFIX", "/api/v1")
 
     REDIS_URL: str = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+    # Optional: comma separated nodes that carry pub/sub and replay streams, channels
+    # consistent-hashed over them. Empty = everything on REDIS_URL.
+    REDIS_SHARD_URLS: str = os.getenv("REDIS_SHARD_URLS", "")
+    REDIS_SHARD_VNODES: int = int(os.getenv("REDIS_SHARD_VNODES", "512"))
 
     ALLOWED_ORIGINS: List[str] = os.getenv("ALLOWED_ORIGINS", ["*"])
 
@@ -16,17 +26,127 @@ class Settings(BaseSettings):
     JWT_ALG: str = os.getenv("JWT_ALG", "HS256")
     JWT_SECRET: str = os.getenv("JWT_SECRET", "dev-secret")
     JWT_USER_ID_CLAIM: str = os.getenv("JWT_USER_ID_CLAIM", "sub")
+    # Verified-token cache (0 disables); entries live until exp, at most the max TTL
+    JWT_CACHE_SIZE: int = int(os.getenv("JWT_CACHE_SIZE", "10000"))
+    JWT_CACHE_MAX_TTL_SECONDS: int = int(os.getenv("JWT_CACHE_MAX_TTL_SECONDS", "300"))
 
     # SSE tuning
     SSE_HEARTBEAT_SECONDS: int = int(os.getenv("SSE_HEARTBEAT_SECONDS", "20"))
     SSE_RETRY_MILLISECONDS: int = int(os.getenv("SSE_RETRY_MILLISECONDS", "1500"))
 
+    # Negotiated stream compression, in preference order ("br" needs the brotli package;
+    # empty disables, the default). Window bits (9-15) and mem level (1-9) bound memory
+    # per stream: 30-40 KB each at 12/5, several times an idle stream without it.
+    SSE_COMPRESSION_ENCODINGS: str = os.getenv("SSE_COMPRESSION_ENCODINGS", "")
+    SSE_COMPRESSION_LEVEL: int = int(os.getenv("SSE_COMPRESSION_LEVEL", "6"))
+    SSE_COMPRESSION_WINDOW_BITS: int = int(os.getenv("SSE_COMPRESSION_WINDOW_BITS", "12"))
+    SSE_COMPRESSION_MEM_LEVEL: int = int(os.getenv("SSE_COMPRESSION_MEM_LEVEL", "5"))
+    SSE_COMPRESSION_BROTLI_QUALITY: int = int(os.getenv("SSE_COMPRESSION_BROTLI_QUALITY", "4"))
+    # Offer x-deflate-dict (preset envelope dictionary) to clients that ask for it
+    SSE_COMPRESSION_DICTIONARY: bool = os.getenv("SSE_COMPRESSION_DICTIONARY", "false").lower() == "true"
+
+    # Admission: per-worker stream cap (0 = unlimited); beyond it new streams get 503
+    SSE_MAX_CONNECTIONS_PER_WORKER: int = int(os.getenv("SSE_MAX_CONNECTIONS_PER_WORKER", "10000"))
+    SSE_ADMISSION_RETRY_AFTER_SECONDS: int = int(os.getenv("SSE_ADMISSION_RETRY_AFTER_SECONDS", "5"))
+    # New streams per second per worker (0 = unlimited), refused before auth past the burst.
+    # Refusals (and capacity 503s) get a random Retry-After of 1 to 2x SSE_ADMISSION_RETRY_AFTER_SECONDS
+    SSE_ADMISSION_RATE_PER_SECOND: float = float(os.getenv("SSE_ADMISSION_RATE_PER_SECOND", "200"))
+    SSE_ADMISSION_BURST: int = int(os.getenv("SSE_ADMISSION_BURST", "400"))
+    # Streams per user: on this worker, and optionally cluster-wide (0 = off; needs the
+    # sessions:<user> registry in Redis). Beyond the cap the oldest stream is closed
+    SSE_MAX_STREAMS_PER_USER: int = int(os.getenv("SSE_MAX_STREAMS_PER_USER", "10"))
+    SSE_MAX_STREAMS_PER_USER_CLUSTER: int = int(os.getenv("SSE_MAX_STREAMS_PER_USER_CLUSTER", "0"))
+    # Drain on shutdown: streams are closed gradually over DRAIN_SECONDS (keep it below
+    # gunicorn's graceful_timeout), each told to reconnect after a random retry in the range
+    SSE_DRAIN_SECONDS: float = float(os.getenv("SSE_DRAIN_SECONDS", "20"))
+    SSE_DRAIN_RETRY_MIN_MS: int = int(os.getenv("SSE_DRAIN_RETRY_MIN_MS", "1000"))
+    SSE_DRAIN_RETRY_MAX_MS: int = int(os.getenv("SSE_DRAIN_RETRY_MAX_MS", "10000"))
+    # Worker rotation after this many requests plus a random jitter (0 = never); drains like a shutdown
+    WORKER_MAX_REQUESTS: int = int(os.getenv("WORKER_MAX_REQUESTS", "0"))
+    WORKER_MAX_REQUESTS_JITTER: int = int(os.getenv("WORKER_MAX_REQUESTS_JITTER", "0"))
+    READINESS_REDIS_TIMEOUT_SECONDS: float = float(os.getenv("READINESS_REDIS_TIMEOUT_SECONDS", "1"))
+
+    # Per-connection buffer bounds; policy on overflow: drop_oldest | coalesce | disconnect
+    SSE_BUFFER_MAX_EVENTS: int = int(os.getenv("SSE_BUFFER_MAX_EVENTS", "1000"))
+    SSE_BUFFER_MAX_BYTES: int = int(os.getenv("SSE_BUFFER_MAX_BYTES", str(1024 * 1024)))
+    SSE_SLOW_CONSUMER_POLICY: str = os.getenv("SSE_SLOW_CONSUMER_POLICY", "drop_oldest")
+
+    # Write coalescing: frames arriving within the window (or up to the byte cap)
+    # are sent as one chunk. 0 ms still merges frames that are already pending;
+    # 0 bytes turns merging off (one frame per write).
+    SSE_WRITE_COALESCE_MILLISECONDS: int = int(os.getenv("SSE_WRITE_COALESCE_MILLISECONDS", "0"))
+    SSE_WRITE_COALESCE_BYTES: int = int(os.getenv("SSE_WRITE_COALESCE_BYTES", str(64 * 1024)))
+
+    # Replay: user events are also kept in a capped per-user Redis Stream so
+    # reconnecting clients get what they missed via Last-Event-ID
+    SSE_REPLAY_ENABLED: bool = os.getenv("SSE_REPLAY_ENABLED", "true").lower() == "true"
+    SSE_REPLAY_MAXLEN: int = int(os.getenv("SSE_REPLAY_MAXLEN", "1000"))
+    SSE_REPLAY_TTL_SECONDS: int = int(os.getenv("SSE_REPLAY_TTL_SECONDS", "86400"))
+    SSE_REPLAY_PAGE_SIZE: int = int(os.getenv("SSE_REPLAY_PAGE_SIZE", "200"))
+
+    # Topics: every stream joins BROADCAST_TOPIC; other topics need a "topic:<name>" scope
+    BROADCAST_TOPIC: str = os.getenv("BROADCAST_TOPIC", "broadcast")
+    SSE_MAX_TOPICS: int = int(os.getenv("SSE_MAX_TOPICS", "32"))
+    SSE_TOPICS_REQUIRE_SCOPE: bool = os.getenv("SSE_TOPICS_REQUIRE_SCOPE", "true").lower() == "true"
+
+    # Publishing
+    PUBLISH_BATCH_MAX_ITEMS: int = int(os.getenv("PUBLISH_BATCH_MAX_ITEMS", "1000"))
+    # Idempotency keys are remembered this long; the per-worker LRU (0 disables) answers
+    # retries that hit the same worker without Redis
+    PUBLISH_IDEMPOTENCY_WINDOW_SECONDS: int = int(os.getenv("PUBLISH_IDEMPOTENCY_WINDOW_SECONDS", "86400"))
+    PUBLISH_IDEMPOTENCY_CACHE_SIZE: int = int(os.getenv("PUBLISH_IDEMPOTENCY_CACHE_SIZE", "10000"))
+
+    # Rate limits: token buckets per target user and per producer address (rate 0 disables;
+    # off by default, size them above the busiest legitimate target). Workers lease
+    # LOCAL_BATCH tokens at a time. Over the limit: reject (429) | summarize
+    RATE_LIMIT_USER_PER_SECOND: float = float(os.getenv("RATE_LIMIT_USER_PER_SECOND", "0"))
+    RATE_LIMIT_USER_BURST: int = int(os.getenv("RATE_LIMIT_USER_BURST", "100"))
+    RATE_LIMIT_PRODUCER_PER_SECOND: float = float(os.getenv("RATE_LIMIT_PRODUCER_PER_SECOND", "0"))
+    RATE_LIMIT_PRODUCER_BURST: int = int(os.getenv("RATE_LIMIT_PRODUCER_BURST", "10000"))
+    RATE_LIMIT_LOCAL_BATCH: int = int(os.getenv("RATE_LIMIT_LOCAL_BATCH", "10"))
+    RATE_LIMIT_MODE: str = os.getenv("RATE_LIMIT_MODE", "reject")
+    RATE_LIMIT_SUMMARY_SECONDS: float = float(os.getenv("RATE_LIMIT_SUMMARY_SECONDS", "5"))
+
+    # Presence: per-worker heartbeats keep a user's entry alive this long
+    PRESENCE_TTL_SECONDS: int = int(os.getenv("PRESENCE_TTL_SECONDS", "30"))
+    PRESENCE_CACHE_SECONDS: float = float(os.getenv("PRESENCE_CACHE_SECONDS", "2"))
+
+    # Persistence (write-behind) and history; off by default. The sqlite backend is a
+    # file on one node: only for single-node deployments (replicas would each keep a subset)
+    PERSISTENCE_BACKEND: str = os.getenv("PERSISTENCE_BACKEND", "none")  # none | sqlite
+    PERSISTENCE_SQLITE_PATH: str = os.getenv("PERSISTENCE_SQLITE_PATH", "/tmp/notifyservice.db")
+    PERSISTENCE_QUEUE_MAX: int = int(os.getenv("PERSISTENCE_QUEUE_MAX", "10000"))
+    PERSISTENCE_BATCH_SIZE: int = int(os.getenv("PERSISTENCE_BATCH_SIZE", "500"))
+    PERSISTENCE_FLUSH_MILLISECONDS: int = int(os.getenv("PERSISTENCE_FLUSH_MILLISECONDS", "200"))
+    HISTORY_MAX_PAGE_SIZE: int = int(os.getenv("HISTORY_MAX_PAGE_SIZE", "100"))
+
+    # Event ids: Snowflake worker number 0-1023; -1 leases a free one from Redis
+    EVENT_ID_WORKER: int = int(os.getenv("EVENT_ID_WORKER", "-1"))
+    EVENT_ID_LEASE_SECONDS: int = int(os.getenv("EVENT_ID_LEASE_SECONDS", "60"))
+
+    # Metrics: how often each worker shares its snapshot for /metrics
+    METRICS_PUSH_SECONDS: float = float(os.getenv("METRICS_PUSH_SECONDS", "5"))
+
     # Internal trust
     INTERNAL_TRUSTED_CIDRS_RAW: str = os.getenv("INTERNAL_TRUSTED_CIDRS", "")
     INTERNAL_TRUSTED_CIDRS: List[str] = []
 
     model_config = SettingsConfigDict(env_file=".env", env_file_encoding="utf-8")
 
+    @field_validator("SSE_SLOW_CONSUMER_POLICY")
+    @classmethod
+    def _check_slow_consumer_policy(cls, value: str) -> str:
+        if value not in POLICIES:
+            raise ValueError(f"must be one of {', '.join(POLICIES)}")
+        return value
+
+    @field_validator("RATE_LIMIT_MODE")
+    @classmethod
+    def _check_rate_limit_mode(cls, value: str) -> str:
+        if value not in RATE_LIMIT_MODES:
+            raise ValueError(f"must be one of {', '.join(RATE_LIMIT_MODES)}")
+        return value
+
     def __init__(self, **data):
         super().__init__(**data)
         if self.INTERNAL_TRUSTED_CIDRS_RAW.strip():
@@ -10,21 +10,25 @@ from app.core.config import settings
 def get_auth_backend() -> AuthBackend:
     return JWTAuthBackend()
 
-async def auth_required(ctx: AuthContext = Depends(get_auth_backend().authenticate)) -> AuthContext:
+# single instance per worker, so backend state (e.g. the verified-token cache) is shared
+auth_backend = get_auth_backend()
+
+async def auth_required(ctx: AuthContext = Depends(auth_backend.authenticate)) -> AuthContext:
     if not ctx or ctx.user_id is None:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Unauthorized")
     return ctx
 
 
-async def internal_trusted(request: Request):
+async def internal_trusted(request: Request) -> str:
+    """Returns the producer identity (client address), which rate limits are kept by."""
+    client_ip = request.client.host if request.client else None
     # If no allowlist is configured, accept all (as requested)
     if not settings.INTERNAL_TRUSTED_CIDRS:
-        return
-    client_ip = request.client.host if request.client else None
+        return client_ip or "unknown"
     if not client_ip:
         raise HTTPException(status_code=403, detail="Forbidden")
     ip = ipaddress.ip_address(client_ip)
     for cidr in settings.INTERNAL_TRUSTED_CIDRS:
         if ip in ipaddress.ip_network(cidr, strict=False):
-            return
+            return client_ip
     raise HTTPException(status_code=403, detail="Forbidden")
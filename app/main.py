@@ -1,21 +1,167 @@
 from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from starlette.exceptions import HTTPException as StarletteHTTPException
 import redis.asyncio as redis
 
 from app.core.config import settings
 from app.api.v1.routes.publish import router as internal_publish_router
-from app.api.v1.routes.stream import router as external_stream_router
+from app.api.v1.routes.sessions import router as internal_sessions_router
+from app.api.v1.routes.stream import refuse_ws_handshake, router as external_stream_router
+from app.api.v1.routes.history import router as external_history_router
 from app.api.v1.routes.health import router as health_router
+from app.api.v1.routes.metrics import router as metrics_router
+from app.core.security import auth_backend
+from app.services import buffer
+from app.services.metrics import MetricsPublisher, registry
+from app.services.shards import RedisShards
+from app.services.subscriber import ShardedSubscriber
+from app.services.connections import ConnectionRegistry
+from app.services.drain import Drainer, RotationMiddleware
+from app.services.persistence import create_persistence_writer
+from app.services.presence import PresenceRegistry
+from app.services.id_lease import WorkerIdLease
+from app.services.idempotency import IdempotencyCache
+from app.services.rate_limit import OverLimitSummarizer, RateLimiter, StreamThrottle
+from app.utils.ids import configure_event_ids, worker_id
 
 
 
+def _register_state_metrics(app: FastAPI) -> None:
+    """Values owned by other components, read when metrics are collected."""
+    registry.callback(
+        "notify_sse_connections", "Active SSE connections",
+        "gauge", lambda: app.state.connections.active,
+    )
+    registry.callback(
+        "notify_buffer_dropped_total", "Frames dropped from full connection buffers",
+        "counter", lambda: buffer.stats.dropped,
+    )
+    registry.callback(
+        "notify_buffer_coalesced_total", "Frames replaced by a newer one of the same type",
+        "counter", lambda: buffer.stats.coalesced,
+    )
+    registry.callback(
+        "notify_buffer_expired_total", "Frames discarded unsent because their ttl_ms passed",
+        "counter", lambda: buffer.stats.expired,
+    )
+    registry.callback(
+        "notify_buffer_evicted_total", "Connections closed for overflowing their buffer",
+        "counter", lambda: buffer.stats.evicted,
+    )
+    registry.callback(
+        "notify_streams_admitted_total", "New streams let through admission",
+        "counter", lambda: app.state.stream_throttle.admitted,
+    )
+    registry.callback(
+        "notify_streams_throttled_total", "New streams refused by the setup rate limit",
+        "counter", lambda: app.state.stream_throttle.throttled,
+    )
+    registry.callback(
+        "notify_subscribed_channels", "Redis channels this worker is subscribed to",
+        "gauge", app.state.subscriber.channel_count,
+    )
+    registry.callback(
+        "notify_presence_local_users", "Distinct users connected to this worker",
+        "gauge", app.state.presence.local_users,
+    )
+    if hasattr(auth_backend, "cache_stats"):
+        registry.callback(
+            "notify_jwt_cache_hits_total", "Verified-token cache hits",
+            "counter", lambda: auth_backend.cache_hits,
+        )
+        registry.callback(
+            "notify_jwt_cache_misses_total", "Verified-token cache misses",
+            "counter", lambda: auth_backend.cache_misses,
+        )
+    if app.state.persistence is not None:
+        writer = app.state.persistence
+        registry.callback(
+            "notify_persisted_total", "Events written by the persistence writer",
+            "counter", lambda: writer.written,
+        )
+        registry.callback(
+            "notify_persist_dropped_total", "Persistent events dropped (queue full or write failure)",
+            "counter", lambda: writer.dropped,
+        )
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    # Presence, metrics and other worker-coordination keys
     app.state.redis = redis.Redis.from_url(settings.REDIS_URL, decode_responses=True)
+    # Unique Snowflake worker number for event ids
+    app.state.id_lease = None
+    if settings.EVENT_ID_WORKER >= 0:
+        configure_event_ids(settings.EVENT_ID_WORKER)
+    else:
+        app.state.id_lease = WorkerIdLease(app.state.redis, worker_id(), settings.EVENT_ID_LEASE_SECONDS)
+        configure_event_ids(await app.state.id_lease.acquire())
+    # Event traffic (pub/sub and replay streams), hashed by channel over the shards.
+    # Stays in bytes: published SSE frames are forwarded as-is
+    shard_urls = [u.strip() for u in settings.REDIS_SHARD_URLS.split(",") if u.strip()]
+    app.state.shards = RedisShards(shard_urls or [settings.REDIS_URL], vnodes=settings.REDIS_SHARD_VNODES)
+    # One pubsub connection per shard per worker, shared by all SSE clients
+    app.state.subscriber = ShardedSubscriber(app.state.shards)
+    await app.state.subscriber.start()
+    app.state.idempotency = IdempotencyCache(
+        settings.PUBLISH_IDEMPOTENCY_CACHE_SIZE, settings.PUBLISH_IDEMPOTENCY_WINDOW_SECONDS
+    )
+    app.state.rate_limiter = RateLimiter(
+        app.state.redis,
+        {
+            "user": (settings.RATE_LIMIT_USER_PER_SECOND, settings.RATE_LIMIT_USER_BURST),
+            "producer": (settings.RATE_LIMIT_PRODUCER_PER_SECOND, settings.RATE_LIMIT_PRODUCER_BURST),
+        },
+        batch=settings.RATE_LIMIT_LOCAL_BATCH,
+    )
+    app.state.summarizer = OverLimitSummarizer(app.state.shards, settings.RATE_LIMIT_SUMMARY_SECONDS)
+    await app.state.summarizer.start()
+    app.state.connections = ConnectionRegistry(
+        settings.SSE_MAX_CONNECTIONS_PER_WORKER,
+        app.state.redis,
+        worker_id(),
+        max_per_user=settings.SSE_MAX_STREAMS_PER_USER,
+        max_per_user_cluster=settings.SSE_MAX_STREAMS_PER_USER_CLUSTER,
+    )
+    await app.state.connections.start()
+    app.state.stream_throttle = StreamThrottle(settings.SSE_ADMISSION_RATE_PER_SECOND, settings.SSE_ADMISSION_BURST)
+    # Shutdown signals drain streams first, then reach the server
+    app.state.drainer = Drainer(
+        app.state.connections,
+        settings.SSE_DRAIN_SECONDS,
+        settings.SSE_DRAIN_RETRY_MIN_MS,
+        settings.SSE_DRAIN_RETRY_MAX_MS,
+    )
+    await app.state.drainer.start()
+    app.state.presence = PresenceRegistry(
+        app.state.redis,
+        worker_id(),
+        ttl_seconds=settings.PRESENCE_TTL_SECONDS,
+        cache_seconds=settings.PRESENCE_CACHE_SECONDS,
+    )
+    await app.state.presence.start()
+    # Write-behind buffer for persistent events (None when disabled)
+    app.state.persistence = create_persistence_writer()
+    if app.state.persistence is not None:
+        await app.state.persistence.start()
+    _register_state_metrics(app)
+    app.state.metrics = MetricsPublisher(app.state.redis, worker_id(), settings.METRICS_PUSH_SECONDS)
+    await app.state.metrics.start()
     try:
         yield
     finally:
+        await app.state.drainer.stop()
+        await app.state.metrics.stop()
+        await app.state.summarizer.stop()
+        if app.state.persistence is not None:
+            await app.state.persistence.stop()
+        await app.state.connections.stop()
+        await app.state.presence.stop()
+        await app.state.subscriber.stop()
+        if app.state.id_lease is not None:
+            await app.state.id_lease.release()
+        await app.state.shards.aclose()
         await app.state.redis.aclose()
 
 
@@ -25,16 +171,27 @@ def create_app() -> FastAPI:
     app.add_middleware(
         CORSMiddleware,
         allow_origins=settings.ALLOWED_ORIGINS)
+    if settings.WORKER_MAX_REQUESTS > 0:
+        app.add_middleware(
+            RotationMiddleware,
+            max_requests=settings.WORKER_MAX_REQUESTS,
+            jitter=settings.WORKER_MAX_REQUESTS_JITTER)
+
+    # refused WebSocket handshakes are closed; HTTP requests get the usual JSON error
+    app.add_exception_handler(StarletteHTTPException, refuse_ws_handshake)
 
     prefix = settings.API_V1_PREFIX.rstrip("/")
 
     # Internal (no auth): publishers inside private network
     app.include_router(internal_publish_router, prefix=f"{prefix}/internal")
+    app.include_router(internal_sessions_router, prefix=f"{prefix}/internal")
 
-    # External (auth): public clients (SSE, later history)
+    # External (auth): public clients (SSE, history)
     app.include_router(external_stream_router, prefix=f"{prefix}/external")
+    app.include_router(external_history_router, prefix=f"{prefix}/external")
 
-    # Health
+    # Health and metrics
     app.include_router(health_router, prefix=f"{prefix}/notify")
+    app.include_router(metrics_router, prefix=f"{prefix}/notify")
 
     return app
@@ -0,0 +1,243 @@
+import asyncio
+import time
+from collections import deque
+from dataclasses import dataclass
+
+
+
+POLICIES = ("drop_oldest", "coalesce", "disconnect")
+
+
+@dataclass
+class BufferStats:
+    dropped: int = 0
+    coalesced: int = 0
+    evicted: int = 0
+    expired: int = 0
+
+
+# worker-wide counters, shared by every connection buffer
+stats = BufferStats()
+
+
+class TaggedFrame(bytes):
+    """
+    A frame with delivery metadata from its publisher: ``expires_at`` (epoch
+    seconds, 0 = never) and ``urgent`` (high-priority lane). Untagged frames
+    are plain bytes, so ordinary traffic pays only a type check.
+    """
+    expires_at: float = 0.0
+    urgent: bool = False
+
+
+def frame_header(expires_at_ms: int | None, urgent: bool) -> bytes:
+    """Line prepended to a published Redis message to tag its frame ("" when there is nothing to tag)."""
+    if expires_at_ms is None and not urgent:
+        return b""
+    return b"!%d,%d\n" % (expires_at_ms or 0, urgent)
+
+def untag(message: bytes) -> bytes:
+    """Strips the frame_header of a Redis message, if any, into a TaggedFrame."""
+    if message[:1] != b"!":
+        return message
+    end = message.index(b"\n")
+    expires, _, urgent = message[1:end].partition(b",")
+    frame = TaggedFrame(message[end + 1:])
+    frame.expires_at = int(expires) / 1000
+    frame.urgent = urgent == b"1"
+    return frame
+
+def expired(frame: bytes, now: float) -> bool:
+    return type(frame) is TaggedFrame and 0 < frame.expires_at <= now
+
+
+def _event_type(frame: bytes) -> bytes | None:
+    start = frame.find(b"event: ")
+    if start < 0:
+        return None
+    start += 7
+    return frame[start:frame.find(b"\n", start)]
+
+
+def _stream_id(frame: bytes) -> tuple[int, int] | None:
+    """The Redis stream entry id of a user frame's ``id:`` line, None for frames without one."""
+    if not frame.startswith(b"id: "):
+        return None
+    ms, _, seq = frame[4:frame.index(b"\n")].partition(b"-")
+    return int(ms), int(seq)
+
+
+class ConnectionBuffer:
+    """
+    Bounded per-connection frame buffer, filled by the shared subscriber and
+    drained by the stream. Urgent frames go to a lane that drains first (one
+    that overtakes pending frames goes out without its ``id:``); frames past
+    their expiry are discarded instead of written. When a consumer falls
+    behind past ``max_events`` or ``max_bytes``, expired frames go first,
+    then the policy decides what gives:
+
+    - ``drop_oldest``: discard the oldest pending frames
+    - ``coalesce``: discard an older pending frame of the same event type,
+      falling back to the oldest (urgent frames are dropped last)
+    - ``disconnect``: drop everything and close the buffer with reason "overflow"
+    """
+
+    def __init__(self, max_events: int, max_bytes: int, policy: str):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown slow-consumer policy: {policy}")
+        self.max_events = max_events
+        self.max_bytes = max_bytes
+        self.policy = policy
+        self.closed_reason: str | None = None
+        self._items: deque[bytes] = deque()
+        self._urgent: deque[bytes] | tuple = ()  # allocated on the first urgent frame
+        # pending frames with an expiry and the earliest of them (a lower bound),
+        # so overflow only scans for expired frames when one may be due
+        self._timed = 0
+        self._next_expiry = 0.0
+        self._bytes = 0
+        self._waiter: asyncio.Future | None = None
+
+    def qsize(self) -> int:
+        return len(self._items) + len(self._urgent)
+
+    def put_nowait(self, frame: bytes) -> None:
+        if self.closed_reason is not None:
+            return
+        if type(frame) is TaggedFrame:
+            if frame.expires_at > 0:
+                if not self._timed or frame.expires_at < self._next_expiry:
+                    self._next_expiry = frame.expires_at
+                self._timed += 1
+            if frame.urgent:
+                if not self._urgent:
+                    self._urgent = deque()
+                self._urgent.append(frame)
+            else:
+                self._items.append(frame)
+        else:
+            self._items.append(frame)
+        self._bytes += len(frame)
+        if self._over():
+            self._overflow(frame)
+        self._wake()
+
+    def close(self, reason: str) -> None:
+        if self.closed_reason is None:
+            self.closed_reason = reason
+        self._wake()
+
+    def get_nowait(self) -> bytes | None:
+        """Next frame if one is pending and the buffer is open, else None."""
+        if self.closed_reason is not None:
+            return None
+        return self._pop()
+
+    async def get(self) -> bytes | None:
+        """Next frame; None once the buffer is closed (pending frames are abandoned)."""
+        while True:
+            while not (self._items or self._urgent) and self.closed_reason is None:
+                self._waiter = asyncio.get_running_loop().create_future()
+                try:
+                    await self._waiter
+                finally:
+                    self._waiter = None
+            if self.closed_reason is not None:
+                return None
+            frame = self._pop()
+            if frame is not None:
+                return frame
+
+    def _pop(self) -> bytes | None:
+        """
+        Next live frame, urgent lane first; expired frames are discarded on the
+        way. An urgent frame that overtakes pending ones loses its ``id:`` line:
+        the client's Last-Event-ID must not move past events it has not had yet
+        (a reconnect then replays the urgent event again, rather than skipping
+        the overtaken ones).
+        """
+        while True:
+            lane = self._urgent or self._items
+            if not lane:
+                return None
+            frame = lane.popleft()
+            self._bytes -= len(frame)
+            if type(frame) is TaggedFrame and frame.expires_at > 0:
+                self._timed -= 1
+                if frame.expires_at <= time.time():
+                    stats.expired += 1
+                    continue
+            if lane is self._urgent and self._items and self._overtakes(frame):
+                frame = frame[frame.index(b"\n") + 1:]
+            return frame
+
+    def _overtakes(self, frame: bytes) -> bool:
+        """Whether an older user frame (lower stream id) is still pending in the normal lane."""
+        frame_id = _stream_id(frame)
+        if frame_id is None:
+            return False
+        for pending in self._items:
+            pending_id = _stream_id(pending)
+            if pending_id is not None:
+                # user frames queue in stream order, so the first one is the oldest
+                return pending_id < frame_id
+        return False
+
+    def _wake(self) -> None:
+        if self._waiter is not None and not self._waiter.done():
+            self._waiter.set_result(None)
+
+    def _over(self) -> bool:
+        return len(self._items) + len(self._urgent) > self.max_events or self._bytes > self.max_bytes
+
+    def _drop(self, lane: deque, index: int) -> None:
+        frame = lane[index]
+        del lane[index]
+        self._bytes -= len(frame)
+        if type(frame) is TaggedFrame and frame.expires_at > 0:
+            self._timed -= 1
+
+    def _purge_expired(self, now: float) -> None:
+        self._next_expiry = float("inf")
+        for lane in (self._items, self._urgent):
+            kept = [frame for frame in lane if not expired(frame, now)]
+            if len(kept) < len(lane):
+                gone = len(lane) - len(kept)
+                stats.expired += gone
+                self._timed -= gone
+                self._bytes -= sum(map(len, lane)) - sum(map(len, kept))
+                lane.clear()
+                lane.extend(kept)
+            for frame in lane:
+                if type(frame) is TaggedFrame and 0 < frame.expires_at < self._next_expiry:
+                    self._next_expiry = frame.expires_at
+
+    def _overflow(self, incoming: bytes) -> None:
+        now = time.time()
+        if self._timed and self._next_expiry <= now:
+            self._purge_expired(now)
+            if not self._over():
+                return
+
+        if self.policy == "disconnect":
+            stats.evicted += 1
+            self._items.clear()
+            self._urgent = ()
+            self._bytes = self._timed = 0
+            self.close("overflow")
+            return
+
+        if self.policy == "coalesce":
+            event_type = _event_type(incoming)
+            lane = self._urgent if type(incoming) is TaggedFrame and incoming.urgent else self._items
+            if event_type is not None:
+                # newest first, skipping the frame that was just appended
+                for i in range(len(lane) - 2, -1, -1):
+                    if _event_type(lane[i]) == event_type:
+                        self._drop(lane, i)
+                        stats.coalesced += 1
+                        break
+
+        while (self._items or self._urgent) and self._over():
+            self._drop(self._items or self._urgent, 0)
+            stats.dropped += 1
@@ -0,0 +1,110 @@
+import zlib
+from typing import AsyncIterator, List, Optional
+
+from app.core.config import settings
+from app.services.metrics import STREAM_BYTES_RAW, STREAM_BYTES_SENT
+
+try:
+    import brotli
+except ImportError:  # optional; "br" is skipped when the package is missing
+    brotli = None
+
+
+
+# Opt-in encoding for our own SDKs: deflate (zlib format) primed with DICTIONARY
+# as a preset dictionary (RFC 1950 FDICT). Standard clients cannot decode it,
+# so it is only chosen when the client names it in Accept-Encoding.
+DICT_ENCODING = "x-deflate-dict"
+
+# Envelope keys and SSE framing every event repeats; zlib matches closer
+# distances more cheaply, so the event template sits at the end. Changing it
+# breaks clients holding the old copy (the zlib header carries its adler32,
+# so a mismatch fails loudly rather than garbling events).
+DICTIONARY = (
+    b'retry: \nevent: ready\ndata: stream-open\n\n:\n\n'
+    b'id: \nevent: \ndata: {"id":"","type":"","user_id":"","data":{},'
+    b'"permalink":null,"created_at":"+00:00","topic":null}\n\n'
+)
+
+
+def _parse_accept_encoding(header: str) -> dict:
+    accepted = {}
+    for part in header.split(","):
+        coding, _, params = part.strip().partition(";")
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[coding] = q
+    return accepted
+
+
+def available_encodings() -> List[str]:
+    """Configured encodings, in server preference order, that this build can produce."""
+    encodings = [e.strip().lower() for e in settings.SSE_COMPRESSION_ENCODINGS.split(",") if e.strip()]
+    if settings.SSE_COMPRESSION_DICTIONARY:
+        encodings.insert(0, DICT_ENCODING)
+    return [e for e in encodings if e != "br" or brotli is not None]
+
+
+def negotiate(accept_encoding: Optional[str]) -> Optional[str]:
+    """Best encoding both sides support; None means identity."""
+    if not accept_encoding:
+        return None
+    accepted = _parse_accept_encoding(accept_encoding)
+    best, best_q = None, 0.0
+    for encoding in available_encodings():
+        q = accepted.get(encoding, accepted.get("*", 0.0) if encoding != DICT_ENCODING else 0.0)
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+class StreamCompressor:
+    """
+    One compression context per stream, flushed after every chunk so each
+    event is decodable on arrival. Window and hash sizes bound the memory a
+    connection holds: about 2**(window_bits+2) + 2**(mem_level+9) bytes for
+    gzip/deflate.
+    """
+
+    def __init__(self, encoding: str):
+        self.encoding = encoding
+        if encoding == "br":
+            self._c = brotli.Compressor(
+                mode=brotli.MODE_TEXT,
+                quality=settings.SSE_COMPRESSION_BROTLI_QUALITY,
+                lgwin=max(settings.SSE_COMPRESSION_WINDOW_BITS, 10),
+            )
+            return
+        wbits = settings.SSE_COMPRESSION_WINDOW_BITS
+        if encoding == "gzip":
+            wbits += 16
+        args = {}
+        if encoding == DICT_ENCODING:
+            args["zdict"] = DICTIONARY
+        elif encoding not in ("gzip", "deflate"):
+            raise ValueError(f"Unsupported encoding: {encoding}")
+        self._c = zlib.compressobj(settings.SSE_COMPRESSION_LEVEL, zlib.DEFLATED, wbits, settings.SSE_COMPRESSION_MEM_LEVEL, **args)
+
+    def compress(self, chunk: bytes) -> bytes:
+        if self.encoding == "br":
+            return self._c.process(chunk) + self._c.flush()
+        return self._c.compress(chunk) + self._c.flush(zlib.Z_SYNC_FLUSH)
+
+
+async def compress_stream(chunks: AsyncIterator[bytes], compressor: StreamCompressor) -> AsyncIterator[bytes]:
+    try:
+        async for chunk in chunks:
+            out = compressor.compress(chunk)
+            STREAM_BYTES_RAW.inc(len(chunk))
+            STREAM_BYTES_SENT.inc(len(out))
+            yield out
+    finally:
+        await chunks.aclose()
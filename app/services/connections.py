@@ -0,0 +1,228 @@
+import asyncio
+import contextlib
+import json
+import logging
+import time
+from typing import Dict, List, Set
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+
+from app.services.buffer import ConnectionBuffer
+from app.services.presence import presence_key
+from app.utils.ids import created_at_from_id, new_event_id
+
+
+
+logger = logging.getLogger(__name__)
+
+CONTROL_CHANNEL = "sessions:control"
+# refreshed on every open; a user idle this long needs no session history
+SESSIONS_TTL_SECONDS = 86400
+
+# buffer close reasons for sessions ended on purpose; clients should not reconnect
+EVICTED = "evicted"
+CLOSED_BY_ADMIN = "closed-by-admin"
+SESSION_CLOSE_REASONS = (EVICTED, CLOSED_BY_ADMIN)
+# "id:" of the closed frame: an EventSource that reconnects anyway sends it back as
+# Last-Event-ID and is answered 204, which stops it for good
+CLOSED_EVENT_ID = "closed"
+# worker shutting down: the client should reconnect (elsewhere) after the hinted retry
+DRAINING = "draining"
+
+
+def sessions_key(user_id: str) -> str:
+    return f"sessions:{user_id}"
+
+
+class Session:
+    """One open stream; closing its buffer ends the stream with ``reason``."""
+
+    __slots__ = ("id", "user_id", "transport", "buffer", "channels", "opened_ms")
+
+    def __init__(self, user_id: str, transport: str, buffer: ConnectionBuffer, channels: Set[str]):
+        self.id = new_event_id()
+        self.user_id = user_id
+        self.transport = transport
+        self.buffer = buffer
+        self.channels = channels
+        self.opened_ms = int(time.time() * 1000)
+
+    def close(self, reason: str) -> None:
+        self.buffer.close(reason)
+
+    def describe(self) -> dict:
+        return {
+            "id": self.id,
+            "transport": self.transport,
+            "opened_at": created_at_from_id(self.id),
+            "channels": sorted(self.channels),
+        }
+
+
+class ConnectionRegistry:
+    """
+    Tracks the streams open on this worker: enforces the per-worker cap, so
+    an overloaded worker turns new clients away instead of falling over, and
+    caps the streams of one user, closing the oldest first.
+
+    With a cluster-wide cap, sessions are mirrored to Redis as a
+    ``sessions:<user_id>`` sorted set (member "worker|session", score = open
+    time). Members of workers whose presence entry for the user has expired
+    are pruned as they are found. Sessions on other workers are closed
+    through ``CONTROL_CHANNEL``, which also carries admin disconnects.
+    """
+
+    def __init__(
+        self,
+        max_connections: int,
+        r: Redis | None = None,
+        worker: str = "",
+        max_per_user: int = 0,
+        max_per_user_cluster: int = 0,
+    ):
+        self.max_connections = max_connections  # 0 = unlimited
+        self.max_per_user = max_per_user
+        self.max_per_user_cluster = max_per_user_cluster if r is not None else 0
+        self.active = 0
+        self._r = r
+        self._worker = worker
+        # user -> session id -> session, oldest first
+        self._sessions: Dict[str, Dict[str, Session]] = {}
+        self._task: asyncio.Task | None = None
+
+    async def start(self) -> None:
+        if self._r is not None:
+            self._task = asyncio.create_task(self._listen())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._task
+        if self.max_per_user_cluster:
+            with contextlib.suppress(RedisError):
+                async with self._r.pipeline(transaction=False) as pipe:
+                    for user_id, sessions in self._sessions.items():
+                        pipe.zrem(sessions_key(user_id), *(self._member(s) for s in sessions.values()))
+                    await pipe.execute()
+
+    def at_capacity(self) -> bool:
+        return 0 < self.max_connections <= self.active
+
+    def local_sessions(self, user_id: str) -> List[Session]:
+        return list(self._sessions.get(user_id, {}).values())
+
+    def sessions(self) -> List[Session]:
+        return [s for sessions in self._sessions.values() for s in sessions.values()]
+
+    async def open(self, user_id: str, buffer: ConnectionBuffer, channels: Set[str], transport: str) -> Session:
+        session = Session(user_id, transport, buffer, channels)
+        sessions = self._sessions.setdefault(user_id, {})
+        sessions[session.id] = session
+        self.active += 1
+        if 0 < self.max_per_user < len(sessions):
+            for oldest in list(sessions.values())[:len(sessions) - self.max_per_user]:
+                oldest.close(EVICTED)
+        if self.max_per_user_cluster:
+            try:
+                await self._open_cluster(session)
+            except RedisError:
+                logger.warning("session registry update failed", exc_info=True)
+        return session
+
+    async def close(self, session: Session) -> None:
+        sessions = self._sessions.get(session.user_id)
+        if sessions is None or sessions.pop(session.id, None) is None:
+            return
+        if not sessions:
+            del self._sessions[session.user_id]
+        self.active -= 1
+        if self.max_per_user_cluster:
+            with contextlib.suppress(RedisError):
+                await self._r.zrem(sessions_key(session.user_id), self._member(session))
+
+    def close_local(self, user_id: str, session_id: str | None = None, reason: str = CLOSED_BY_ADMIN) -> int:
+        sessions = [s for s in self.local_sessions(user_id) if session_id is None or s.id == session_id]
+        for session in sessions:
+            session.close(reason)
+        return len(sessions)
+
+    async def disconnect(self, user_id: str, session_id: str | None = None) -> int:
+        """Closes the user's sessions (or one of them) on every worker; returns how many were here."""
+        closed = self.close_local(user_id, session_id)
+        if self._r is not None:
+            await self._r.publish(CONTROL_CHANNEL, json.dumps(
+                {"user_id": user_id, "session_id": session_id, "reason": CLOSED_BY_ADMIN, "from": self._worker}
+            ))
+        return closed
+
+    async def cluster_sessions(self, user_id: str) -> List[dict]:
+        """The user's sessions on live workers, oldest first (requires the cluster registry)."""
+        return [
+            {"id": session_id, "worker": worker, "opened_ms": int(score)}
+            for worker, session_id, score in await self._live_members(user_id)
+        ]
+
+    def _member(self, session: Session) -> str:
+        return f"{self._worker}|{session.id}"
+
+    async def _live_members(self, user_id: str, add: Session | None = None) -> List[tuple]:
+        """(worker, session id, opened ms) on live workers, oldest first; optionally adds ``add`` first."""
+        key = sessions_key(user_id)
+        async with self._r.pipeline(transaction=False) as pipe:
+            if add is not None:
+                pipe.zadd(key, {self._member(add): add.opened_ms})
+                pipe.expire(key, SESSIONS_TTL_SECONDS)
+            pipe.zrange(key, 0, -1, withscores=True)
+            pipe.hgetall(presence_key(user_id))
+            *_, members, presence = await pipe.execute()
+        now_ms = int(time.time() * 1000)
+        live, stale = [], []
+        for member, score in members:
+            worker, _, session_id = member.rpartition("|")
+            if int(presence.get(worker, 0)) > now_ms:
+                live.append((worker, session_id, score))
+            else:
+                stale.append(member)
+        if stale:
+            await self._r.zrem(key, *stale)
+        return live
+
+    async def _open_cluster(self, session: Session) -> None:
+        key = sessions_key(session.user_id)
+        live = await self._live_members(session.user_id, add=session)
+        excess = live[:max(0, len(live) - self.max_per_user_cluster)]
+        if not excess:
+            return
+        await self._r.zrem(key, *(f"{worker}|{session_id}" for worker, session_id, _ in excess))
+        for worker, session_id, _ in excess:
+            if worker == self._worker:
+                self.close_local(session.user_id, session_id, EVICTED)
+            else:
+                await self._r.publish(CONTROL_CHANNEL, json.dumps(
+                    {"user_id": session.user_id, "session_id": session_id, "reason": EVICTED, "from": self._worker}
+                ))
+
+    async def _listen(self) -> None:
+        pubsub = self._r.pubsub()
+        try:
+            while True:
+                try:
+                    if not pubsub.subscribed:
+                        await pubsub.subscribe(CONTROL_CHANNEL)
+                    msg = await pubsub.get_message(ignore_subscribe_messages=True, timeout=None)
+                except RedisError:
+                    logger.warning("session control channel error, retrying", exc_info=True)
+                    await asyncio.sleep(1.0)
+                    continue
+                if msg is None or msg.get("type") != "message":
+                    continue
+                try:
+                    command = json.loads(msg["data"])
+                except ValueError:
+                    continue
+                if command.get("from") != self._worker:
+                    self.close_local(command["user_id"], command.get("session_id"), command.get("reason", CLOSED_BY_ADMIN))
+        finally:
+            with contextlib.suppress(Exception):
+                await pubsub.aclose()
@@ -0,0 +1,121 @@
+import asyncio
+import contextlib
+import logging
+import random
+import signal
+import threading
+from typing import Callable, Dict
+
+from app.services.connections import DRAINING, ConnectionRegistry
+
+
+
+logger = logging.getLogger(__name__)
+
+
+class Drainer:
+    """
+    Worker shutdown without a reconnect storm: once draining, new streams are
+    refused, and open ones are closed one by one in random order, evenly over
+    ``seconds``. Each gets a resume hint with a random ``retry:`` between
+    ``retry_min_ms`` and ``retry_max_ms``, so clients come back as a ramp
+    spread over the whole window instead of all at once.
+
+    ``start()`` chains SIGTERM/SIGINT: the first one drains, then hands the
+    signal on to the previous handler (the server's, which would otherwise
+    cut every stream at once). A second signal goes straight through.
+    """
+
+    def __init__(self, connections: ConnectionRegistry, seconds: float, retry_min_ms: int, retry_max_ms: int):
+        self._connections = connections
+        self._seconds = seconds
+        self._retry = (retry_min_ms, max(retry_min_ms, retry_max_ms))
+        self.draining = False
+        self._task: asyncio.Task | None = None
+        self._previous: Dict[int, object] = {}
+
+    async def start(self) -> None:
+        # signal handlers can only be set from the main thread (not under test clients)
+        if threading.current_thread() is not threading.main_thread():
+            return
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            self._previous[sig] = signal.getsignal(sig)
+
+            def handler(signum: int, frame) -> None:
+                if self.draining:
+                    self._forward(signum, frame)
+                else:
+                    loop.call_soon_threadsafe(self.begin, lambda: self._forward(signum))
+
+            signal.signal(sig, handler)
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._task
+        for sig, previous in self._previous.items():
+            signal.signal(sig, previous)
+        self._previous = {}
+
+    def retry_ms(self) -> int:
+        return random.randint(*self._retry)
+
+    def begin(self, then: Callable[[], None] | None = None) -> None:
+        """Starts draining (once); ``then`` runs when every stream is closed or the window is over."""
+        if self.draining:
+            return
+        self.draining = True
+        logger.info("draining %s streams over %ss", self._connections.active, self._seconds)
+        self._task = asyncio.create_task(self._run(then))
+
+    async def _run(self, then: Callable[[], None] | None) -> None:
+        loop = asyncio.get_running_loop()
+        sessions = self._connections.sessions()
+        random.shuffle(sessions)
+        start = loop.time()
+        step = self._seconds / max(1, len(sessions))
+        for i, session in enumerate(sessions):
+            delay = start + i * step - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            session.close(DRAINING)
+        # streams admitted just before draining began
+        for session in self._connections.sessions():
+            session.close(DRAINING)
+        # let the closed streams write their last frame
+        deadline = start + self._seconds + 1
+        while self._connections.active and loop.time() < deadline:
+            await asyncio.sleep(0.05)
+        if then is not None:
+            then()
+
+    def _forward(self, signum: int, frame=None) -> None:
+        previous = self._previous.get(signum)
+        if callable(previous):
+            previous(signum, frame)
+        elif previous == signal.SIG_DFL:
+            signal.signal(signum, signal.SIG_DFL)
+            signal.raise_signal(signum)
+
+
+class RotationMiddleware:
+    """
+    Recycles the worker after ``max_requests`` requests (plus up to ``jitter``)
+    by signalling itself, so rotation drains streams like any shutdown.
+    Replaces gunicorn's max_requests, which exits without draining.
+    """
+
+    def __init__(self, app, max_requests: int, jitter: int):
+        self.app = app
+        self._limit = max_requests + random.randint(0, max(0, jitter))
+        self._seen = 0
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] in ("http", "websocket"):
+            self._seen += 1
+            if self._seen == self._limit:
+                logger.info("max requests (%s) reached, recycling worker", self._limit)
+                signal.raise_signal(signal.SIGTERM)
+        await self.app(scope, receive, send)
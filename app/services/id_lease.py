@@ -0,0 +1,105 @@
+import asyncio
+import contextlib
+import logging
+import os
+import random
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+
+from app.utils.ids import MAX_WORKER
+
+
+
+logger = logging.getLogger(__name__)
+
+# Extends the lease if this worker holds it, reclaims it if it lapsed, else 0
+_RENEW_LUA = """
+local holder = redis.call('GET', KEYS[1])
+if holder == ARGV[1] then
+  return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+end
+if not holder then
+  redis.call('SET', KEYS[1], ARGV[1], 'PX', ARGV[2])
+  return 1
+end
+return 0
+"""
+
+# Deletes the slot only if this worker still holds it
+_RELEASE_LUA = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+  return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+# Redis errors while acquiring are retried with doubling delays (about 6 s in all)
+# before falling back to a pid-derived number, so a Redis blip does not fail startup
+ACQUIRE_ATTEMPTS = 5
+ACQUIRE_FIRST_DELAY_SECONDS = 0.2
+
+
+def slot_key(slot: int) -> str:
+    return f"ids:worker:{slot}"
+
+
+class WorkerIdLease:
+    """
+    Leases one of the 1024 Snowflake worker numbers from Redis, so ids stay
+    unique without configuring every process by hand. The lease is renewed in
+    the background and released on shutdown; a crashed worker's slot frees
+    itself after the TTL.
+    """
+
+    def __init__(self, r: Redis, worker: str, ttl_seconds: int):
+        self._r = r
+        self._worker = worker
+        self._ttl_ms = ttl_seconds * 1000
+        self.slot: int | None = None
+        self._task: asyncio.Task | None = None
+
+    async def acquire(self) -> int:
+        """Leased worker number; without Redis, a pid-derived one (logged, as ids may then collide)."""
+        delay = ACQUIRE_FIRST_DELAY_SECONDS
+        for attempt in range(1, ACQUIRE_ATTEMPTS + 1):
+            try:
+                return await self._acquire()
+            except RedisError:
+                if attempt == ACQUIRE_ATTEMPTS:
+                    break
+                logger.warning("event id lease failed (attempt %s), retrying in %ss", attempt, delay, exc_info=True)
+                await asyncio.sleep(delay)
+                delay *= 2
+        fallback = os.getpid() % (MAX_WORKER + 1)
+        logger.error("could not lease an event id worker number; using %s from the pid, ids may collide", fallback)
+        return fallback
+
+    async def _acquire(self) -> int:
+        # random starting point, so restarting workers don't all race for slot 0
+        start = random.randrange(MAX_WORKER + 1)
+        for i in range(MAX_WORKER + 1):
+            slot = (start + i) % (MAX_WORKER + 1)
+            if await self._r.set(slot_key(slot), self._worker, nx=True, px=self._ttl_ms):
+                self.slot = slot
+                self._task = asyncio.create_task(self._renew())
+                return slot
+        raise RuntimeError("No free event id worker slot (more than 1024 live workers?)")
+
+    async def release(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._task
+        if self.slot is not None:
+            with contextlib.suppress(RedisError):
+                await self._r.eval(_RELEASE_LUA, 1, slot_key(self.slot), self._worker)
+
+    async def _renew(self) -> None:
+        while True:
+            await asyncio.sleep(self._ttl_ms / 1000 / 3)
+            try:
+                if not await self._r.eval(_RENEW_LUA, 1, slot_key(self.slot), self._worker, self._ttl_ms):
+                    logger.error("event id worker slot %s was taken over; ids may collide", self.slot)
+            except RedisError:
+                logger.warning("event id lease renewal failed", exc_info=True)
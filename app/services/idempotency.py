@@ -0,0 +1,42 @@
+import time
+from collections import OrderedDict
+from typing import Tuple
+
+
+
+def dedupe_key(channel: str, key: str) -> str:
+    """Redis key for a producer's idempotency key; scoped to the target channel so it lives on that shard."""
+    return f"idem:{channel}:{key}"
+
+
+class IdempotencyCache:
+    """
+    Per-worker LRU of idempotency keys this worker has published or seen
+    rejected: a retry that lands on the same worker is answered without a
+    Redis round trip. Redis (SET NX inside the publish script) stays the
+    authority, so a miss here only means the check is made there.
+    """
+
+    def __init__(self, size: int, window_seconds: int):
+        self.size = size
+        self.window = window_seconds
+        self._entries: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+
+    def get(self, key: str) -> str | None:
+        """Event id first published under ``key``, if known here and still inside the window."""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[1] <= time.time():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry[0]
+
+    def put(self, key: str, event_id: str) -> None:
+        if self.size <= 0:
+            return
+        self._entries[key] = (event_id, time.time() + self.window)
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.size:
+            self._entries.popitem(last=False)
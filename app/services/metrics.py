@@ -0,0 +1,228 @@
+import asyncio
+import contextlib
+import json
+import logging
+import os
+import resource
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, List, Sequence
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+
+
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOTS_KEY = "metrics:workers"
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+DEPTH_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+
+# Recording is a plain attribute update: each worker runs a single event loop
+# thread, so no locks are needed and the hot-path cost is a few nanoseconds.
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self.value = 0
+
+    def inc(self, n: int = 1) -> None:
+        self.value += n
+
+    def snapshot(self):
+        return self.value
+
+
+class Gauge:
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self.value = 0
+
+    def inc(self, n: int = 1) -> None:
+        self.value += n
+
+    def dec(self, n: int = 1) -> None:
+        self.value -= n
+
+    def set(self, value) -> None:
+        self.value = value
+
+    def snapshot(self):
+        return self.value
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, buckets: Sequence[float]):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # last slot is +Inf
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def snapshot(self):
+        return {"buckets": self.buckets, "counts": self.counts, "sum": self.sum}
+
+
+class Callback:
+    """A value read at collection time from state owned elsewhere."""
+
+    def __init__(self, name: str, help: str, kind: str, fn: Callable[[], float]):
+        self.name = name
+        self.help = help
+        self.kind = kind
+        self.fn = fn
+
+    def snapshot(self):
+        return self.fn()
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, object] = {}
+
+    def _add(self, metric):
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str) -> Counter:
+        return self._add(Counter(name, help))
+
+    def gauge(self, name: str, help: str) -> Gauge:
+        return self._add(Gauge(name, help))
+
+    def histogram(self, name: str, help: str, buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self._add(Histogram(name, help, buckets))
+
+    def callback(self, name: str, help: str, kind: str, fn: Callable[[], float]) -> Callback:
+        return self._add(Callback(name, help, kind, fn))
+
+    def snapshot(self) -> dict:
+        values = {}
+        for name, metric in self._metrics.items():
+            try:
+                values[name] = metric.snapshot()
+            except Exception:
+                logger.warning("metric %s failed to collect", name, exc_info=True)
+        return {"ts": time.time(), "values": values}
+
+    def render(self, snapshots: Dict[str, dict]) -> str:
+        """Prometheus text format; one sample per worker, labelled ``worker``."""
+        lines: List[str] = []
+        for name, metric in self._metrics.items():
+            lines.append(f"# HELP {name} {metric.help}")
+            lines.append(f"# TYPE {name} {metric.kind}")
+            for worker, snap in snapshots.items():
+                value = snap["values"].get(name)
+                if value is None:
+                    continue
+                label = f'worker="{worker}"'
+                if metric.kind != "histogram":
+                    lines.append(f"{name}{{{label}}} {value}")
+                    continue
+                cumulative = 0
+                for bound, count in zip(value["buckets"], value["counts"]):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{{{label},le="{bound}"}} {cumulative}')
+                cumulative += value["counts"][-1]
+                lines.append(f'{name}_bucket{{{label},le="+Inf"}} {cumulative}')
+                lines.append(f"{name}_sum{{{label}}} {value['sum']}")
+                lines.append(f"{name}_count{{{label}}} {cumulative}")
+        return "\n".join(lines) + "\n"
+
+
+def _resident_memory_bytes() -> int:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        # no procfs: peak RSS is the closest stand-in
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+registry = Registry()
+
+PUBLISH_SECONDS = registry.histogram("notify_publish_seconds", "Publish handler latency")
+PUBLISH_BATCH_SECONDS = registry.histogram("notify_publish_batch_seconds", "Batch publish handler latency")
+REDIS_PUBLISH_SECONDS = registry.histogram("notify_redis_publish_seconds", "Redis publish round trip (one command or one pipeline)")
+SSE_QUEUE_DEPTH = registry.histogram("notify_sse_queue_depth", "Frames pending on a connection when it wakes to write", DEPTH_BUCKETS)
+EVENTS_DELIVERED = registry.counter("notify_events_delivered_total", "Event frames written to clients")
+HEARTBEATS = registry.counter("notify_heartbeats_total", "Heartbeat frames written to clients")
+AUTH_FAILURES = registry.counter("notify_auth_failures_total", "Rejected authentication attempts")
+STREAM_BYTES_RAW = registry.counter("notify_stream_compressed_input_bytes_total", "SSE bytes fed to stream compressors")
+STREAM_BYTES_SENT = registry.counter("notify_stream_compressed_output_bytes_total", "Compressed SSE bytes written")
+PUBLISH_DUPLICATES = registry.counter("notify_publish_duplicates_total", "Publishes answered with the event id of an earlier one (idempotency key reused)")
+PUBLISH_RATE_LIMITED = registry.counter("notify_publish_rate_limited_total", "Events rejected by a rate limit")
+PUBLISH_SUMMARIZED = registry.counter("notify_publish_summarized_total", "Over-limit events folded into a summary event")
+WS_ACKS = registry.counter("notify_ws_acks_total", "Acks received from WebSocket clients")
+
+# per-connection transport cost is read off these (see dev_tools/sse_benchmark.py)
+registry.callback("notify_process_resident_memory_bytes", "Resident memory of the worker process", "gauge", _resident_memory_bytes)
+registry.callback("notify_process_cpu_seconds_total", "CPU time used by the worker process", "counter", time.process_time)
+
+
+class MetricsPublisher:
+    """
+    Shares this worker's snapshot with the other workers through one Redis
+    hash, so whichever worker serves /metrics can report for all of them.
+    """
+
+    def __init__(self, r: Redis, worker: str, interval: float):
+        self._r = r
+        self._worker = worker
+        self._interval = interval
+        self._task: asyncio.Task | None = None
+
+    async def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._task
+        with contextlib.suppress(RedisError):
+            await self._r.hdel(SNAPSHOTS_KEY, self._worker)
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self._r.hset(SNAPSHOTS_KEY, self._worker, json.dumps(registry.snapshot()))
+            except RedisError:
+                logger.warning("failed to publish metrics snapshot", exc_info=True)
+            await asyncio.sleep(self._interval)
+
+    async def collect(self) -> Dict[str, dict]:
+        """Fresh local snapshot plus the live snapshots of the other workers."""
+        snapshots: Dict[str, dict] = {}
+        stale: List[str] = []
+        try:
+            raw = await self._r.hgetall(SNAPSHOTS_KEY)
+        except RedisError:
+            logger.warning("failed to read metrics snapshots", exc_info=True)
+            raw = {}
+        cutoff = time.time() - 3 * self._interval
+        for worker, payload in raw.items():
+            snap = json.loads(payload)
+            if snap["ts"] < cutoff:
+                stale.append(worker)
+            else:
+                snapshots[worker] = snap
+        if stale:
+            with contextlib.suppress(RedisError):
+                await self._r.hdel(SNAPSHOTS_KEY, *stale)
+        snapshots[self._worker] = registry.snapshot()
+        return snapshots
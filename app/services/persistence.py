@@ -1,7 +1,215 @@
+import asyncio
+import logging
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+
 from app.api.v1.schemas import EventEnvelope
+from app.core.config import settings
+
+
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class PersistenceBackend:
+    """Storage for persistent events. History is keyset-paginated on (user_id, id)."""
+
+    async def open(self) -> None:
+        return None
+
+    async def close(self) -> None:
+        return None
+
+    async def write_many(self, envelopes: List[EventEnvelope]) -> None:
+        raise NotImplementedError
+
+    async def history(self, user_id: str, before: Optional[str], limit: int) -> List[str]:
+        """Stored envelope JSON for ``user_id``, newest first, with ids strictly below ``before``."""
+        raise NotImplementedError
+
+
+class SQLiteBackend(PersistenceBackend):
+    """
+    Local backend for development and single-node setups. The SQL sticks to
+    what SQLite and Postgres both accept, so a Postgres backend only changes
+    the driver and placeholder style.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS notify_events (
+            user_id    TEXT NOT NULL,
+            id         TEXT NOT NULL,
+            type       TEXT NOT NULL,
+            payload    TEXT NOT NULL,
+            created_at TEXT NOT NULL,
+            PRIMARY KEY (user_id, id)
+        )
+    """
+    # stay well below SQLite's bound-parameter limit
+    MAX_ROWS_PER_INSERT = 500
+
+    def __init__(self, path: str):
+        self.path = path
+        # one thread each, so every connection is only touched by its own thread
+        self._write_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="persist-w")
+        self._read_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="persist-r")
+        self._write_conn: sqlite3.Connection | None = None
+        self._read_conn: sqlite3.Connection | None = None
+
+    async def _run(self, pool: ThreadPoolExecutor, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(pool, fn, *args)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=5000")
+        return conn
+
+    def _open_writer(self) -> None:
+        self._write_conn = self._connect()
+        self._write_conn.execute(self.SCHEMA)
+
+    def _open_reader(self) -> None:
+        self._read_conn = self._connect()
+
+    async def open(self) -> None:
+        await self._run(self._write_pool, self._open_writer)
+        await self._run(self._read_pool, self._open_reader)
+
+    async def close(self) -> None:
+        if self._write_conn is not None:
+            await self._run(self._write_pool, self._write_conn.close)
+        if self._read_conn is not None:
+            await self._run(self._read_pool, self._read_conn.close)
+        self._write_pool.shutdown(wait=True)
+        self._read_pool.shutdown(wait=True)
+
+    def _insert(self, rows: List[tuple]) -> None:
+        conn = self._write_conn
+        conn.execute("BEGIN")
+        try:
+            for start in range(0, len(rows), self.MAX_ROWS_PER_INSERT):
+                chunk = rows[start:start + self.MAX_ROWS_PER_INSERT]
+                values = ",".join(["(?, ?, ?, ?, ?)"] * len(chunk))
+                params = [v for row in chunk for v in row]
+                conn.execute(
+                    f"INSERT INTO notify_events (user_id, id, type, payload, created_at) VALUES {values} "
+                    "ON CONFLICT DO NOTHING",
+                    params,
+                )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    async def write_many(self, envelopes: List[EventEnvelope]) -> None:
+        rows = [(e.user_id, e.id, e.type, e.model_dump_json(), e.created_at) for e in envelopes]
+        await self._run(self._write_pool, self._insert, rows)
+
+    def _select(self, user_id: str, before: Optional[str], limit: int) -> List[str]:
+        if before is None:
+            cur = self._read_conn.execute(
+                "SELECT payload FROM notify_events WHERE user_id = ? ORDER BY id DESC LIMIT ?",
+                (user_id, limit),
+            )
+        else:
+            cur = self._read_conn.execute(
+                "SELECT payload FROM notify_events WHERE user_id = ? AND id < ? ORDER BY id DESC LIMIT ?",
+                (user_id, before, limit),
+            )
+        return [row[0] for row in cur.fetchall()]
+
+    async def history(self, user_id: str, before: Optional[str], limit: int) -> List[str]:
+        return await self._run(self._read_pool, self._select, user_id, before, limit)
+
+
+class PersistenceWriter:
+    """
+    Write-behind buffer in front of a backend. ``submit`` never waits on the
+    database: events go to a bounded in-process queue that is flushed in
+    batches when it reaches the batch size or the flush interval elapses.
+    """
+
+    def __init__(self, backend: PersistenceBackend, max_queue: int, batch_size: int, flush_interval: float):
+        self.backend = backend
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue)
+        self._batch_size = batch_size
+        self._flush_interval = flush_interval
+        self._task: asyncio.Task | None = None
+        self.dropped = 0
+        self.written = 0
+
+    async def start(self) -> None:
+        await self.backend.open()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            # flush whatever is queued before shutting the backend down
+            await self._queue.put(_STOP)
+            await self._task
+        await self.backend.close()
+
+    def submit(self, envelope: EventEnvelope) -> None:
+        try:
+            self._queue.put_nowait(envelope)
+        except asyncio.QueueFull:
+            self.dropped += 1
+            logger.warning("persistence queue full, dropping event %s", envelope.id)
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            item = await self._queue.get()
+            if item is _STOP:
+                return
+            batch = [item]
+            deadline = loop.time() + self._flush_interval
+            while len(batch) < self._batch_size:
+                try:
+                    item = self._queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    try:
+                        async with asyncio.timeout_at(deadline):
+                            item = await self._queue.get()
+                    except TimeoutError:
+                        break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            await self._flush(batch)
+
+    async def _flush(self, batch: List[EventEnvelope]) -> None:
+        try:
+            await self.backend.write_many(batch)
+            self.written += len(batch)
+        except Exception:
+            self.dropped += len(batch)
+            logger.exception("failed to persist %d events", len(batch))
+
 
+def create_persistence_writer() -> Optional[PersistenceWriter]:
+    if settings.PERSISTENCE_BACKEND == "none":
+        return None
+    if settings.PERSISTENCE_BACKEND == "sqlite":
+        backend = SQLiteBackend(settings.PERSISTENCE_SQLITE_PATH)
+    else:
+        raise ValueError(f"Unknown PERSISTENCE_BACKEND: {settings.PERSISTENCE_BACKEND}")
+    return PersistenceWriter(
+        backend,
+        max_queue=settings.PERSISTENCE_QUEUE_MAX,
+        batch_size=settings.PERSISTENCE_BATCH_SIZE,
+        flush_interval=settings.PERSISTENCE_FLUSH_MILLISECONDS / 1000,
+    )
 
 
-async def save_persistent_event(envelope: EventEnvelope) -> None:
-    # placeholder (TimescaleDB in future)
-    return None
+async def save_persistent_event(writer: Optional[PersistenceWriter], envelope: EventEnvelope) -> None:
+    if writer is None:
+        return None
+    writer.submit(envelope)
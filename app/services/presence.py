@@ -0,0 +1,129 @@
+import asyncio
+import contextlib
+import logging
+import time
+from typing import Dict, Iterable, Tuple
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+
+
+
+logger = logging.getLogger(__name__)
+
+
+def presence_key(user_id: str) -> str:
+    return f"presence:{user_id}"
+
+
+class PresenceRegistry:
+    """
+    Cluster-wide "is this user connected anywhere?" index.
+
+    Each worker keeps local per-user connection counts and mirrors them to
+    Redis as ``presence:<user_id>`` hashes of worker id -> expiry (epoch ms).
+    A heartbeat refreshes the expiries, so entries of a crashed worker age out
+    on their own. Lookups hit the local connections first, then a short-lived
+    read cache, and only then Redis.
+    """
+
+    HEARTBEAT_CHUNK = 1000
+    MAX_CACHE_ENTRIES = 100_000
+
+    def __init__(self, r: Redis, worker: str, ttl_seconds: int, cache_seconds: float):
+        self._r = r
+        self._worker = worker
+        self._ttl_ms = ttl_seconds * 1000
+        self._cache_seconds = cache_seconds
+        self._local: Dict[str, int] = {}
+        self._cache: Dict[str, Tuple[bool, float]] = {}
+        self._task: asyncio.Task | None = None
+
+    async def start(self) -> None:
+        self._task = asyncio.create_task(self._heartbeat())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._task
+        with contextlib.suppress(RedisError):
+            await self._write(self._local, present=False)
+
+    def local_users(self) -> int:
+        return len(self._local)
+
+    async def connect(self, user_id: str) -> None:
+        count = self._local.get(user_id, 0)
+        self._local[user_id] = count + 1
+        if count == 0:
+            with contextlib.suppress(RedisError):
+                await self._write([user_id], present=True)
+
+    async def disconnect(self, user_id: str) -> None:
+        count = self._local.get(user_id, 0) - 1
+        if count > 0:
+            self._local[user_id] = count
+            return
+        self._local.pop(user_id, None)
+        with contextlib.suppress(RedisError):
+            await self._write([user_id], present=False)
+
+    async def is_online(self, user_id: str) -> bool:
+        if user_id in self._local:
+            return True
+        cached = self._cache.get(user_id)
+        if cached is not None and cached[1] > time.monotonic():
+            return cached[0]
+        await self.prefetch([user_id])
+        # unknown (Redis unreachable) counts as offline: push is the fallback
+        cached = self._cache.get(user_id)
+        return cached is not None and cached[0]
+
+    async def prefetch(self, user_ids: Iterable[str]) -> None:
+        """Loads presence for many users in one round trip into the read cache."""
+        now = time.monotonic()
+        missing = [
+            u for u in dict.fromkeys(user_ids)
+            if u not in self._local and (u not in self._cache or self._cache[u][1] <= now)
+        ]
+        if not missing:
+            return
+        try:
+            async with self._r.pipeline(transaction=False) as pipe:
+                for user_id in missing:
+                    pipe.hvals(presence_key(user_id))
+                results = await pipe.execute()
+        except RedisError:
+            logger.warning("presence lookup failed", exc_info=True)
+            return
+
+        if len(self._cache) > self.MAX_CACHE_ENTRIES:
+            self._cache.clear()
+        now_ms = int(time.time() * 1000)
+        valid_until = now + self._cache_seconds
+        for user_id, expiries in zip(missing, results):
+            online = any(int(e) > now_ms for e in expiries)
+            self._cache[user_id] = (online, valid_until)
+
+    async def _write(self, user_ids: Iterable[str], present: bool) -> None:
+        user_ids = list(user_ids)
+        expiry = int(time.time() * 1000) + self._ttl_ms
+        for start in range(0, len(user_ids), self.HEARTBEAT_CHUNK):
+            async with self._r.pipeline(transaction=False) as pipe:
+                for user_id in user_ids[start:start + self.HEARTBEAT_CHUNK]:
+                    key = presence_key(user_id)
+                    if present:
+                        pipe.hset(key, self._worker, expiry)
+                        pipe.pexpire(key, self._ttl_ms)
+                    else:
+                        pipe.hdel(key, self._worker)
+                await pipe.execute()
+
+    async def _heartbeat(self) -> None:
+        interval = self._ttl_ms / 1000 / 3
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self._write(self._local, present=True)
+            except RedisError:
+                logger.warning("presence heartbeat failed", exc_info=True)
@@ -1,14 +1,196 @@
-import json
+import asyncio
+import time
+from typing import List, Tuple
 from redis.asyncio import Redis
+from redis.commands.core import AsyncScript
 
 from app.api.v1.schemas import EventEnvelope
+from app.core.config import settings
+from app.services.buffer import frame_header
+from app.services.metrics import REDIS_PUBLISH_SECONDS
+from app.services.shards import RedisShards
 
 
 
+# Appends the frame to the user's capped stream and publishes it with the
+# stream entry id as the SSE "id:" line, so Last-Event-ID is a replay cursor.
+# ARGV[5] is the frame_header for live delivery; ARGV[6] an expiry (epoch ms)
+# kept with the entry as "x" so replay skips it too, or "".
+_PUBLISH_LUA = """
+local id
+if ARGV[6] ~= '' then
+  id = redis.call('XADD', KEYS[1], 'MAXLEN', '~', ARGV[1], '*', 'f', ARGV[3], 'x', ARGV[6])
+else
+  id = redis.call('XADD', KEYS[1], 'MAXLEN', '~', ARGV[1], '*', 'f', ARGV[3])
+end
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+redis.call('PUBLISH', ARGV[4], ARGV[5] .. 'id: ' .. id .. '\\n' .. ARGV[3])
+return id
+"""
+
+# _PUBLISH_LUA (or a plain PUBLISH when there is no stream key) guarded by a
+# producer idempotency key: the first call stores its event id under KEYS[1]
+# for the window and publishes; repeats publish nothing. Returns
+# {1, id} when published, {0, original id} for a duplicate. ARGV[7] and
+# ARGV[8] are the header and expiry as in _PUBLISH_LUA.
+_IDEMPOTENT_PUBLISH_LUA = """
+local prior = redis.call('GET', KEYS[1])
+if prior then
+  return {0, prior}
+end
+redis.call('SET', KEYS[1], ARGV[1], 'PX', ARGV[2])
+if KEYS[2] then
+  local id
+  if ARGV[8] ~= '' then
+    id = redis.call('XADD', KEYS[2], 'MAXLEN', '~', ARGV[5], '*', 'f', ARGV[3], 'x', ARGV[8])
+  else
+    id = redis.call('XADD', KEYS[2], 'MAXLEN', '~', ARGV[5], '*', 'f', ARGV[3])
+  end
+  redis.call('EXPIRE', KEYS[2], ARGV[6])
+  redis.call('PUBLISH', ARGV[4], ARGV[7] .. 'id: ' .. id .. '\\n' .. ARGV[3])
+else
+  redis.call('PUBLISH', ARGV[4], ARGV[3])
+end
+return {1, ARGV[1]}
+"""
+
+_publish_script: AsyncScript | None = None
+_idempotent_script: AsyncScript | None = None
+
 def user_channel(user_id: str) -> str:
     return f"user:{user_id}"
 
-async def publish_event(r: Redis, envelope: EventEnvelope) -> None:
-    ch = user_channel(envelope.user_id)
-    payload = json.dumps(envelope.model_dump())
-    await r.publish(ch, payload)
+def topic_channel(topic: str) -> str:
+    return f"topic:{topic}"
+
+def user_stream(user_id: str) -> str:
+    return f"stream:{user_channel(user_id)}"
+
+def event_channel(envelope: EventEnvelope) -> str:
+    if envelope.topic is not None:
+        return topic_channel(envelope.topic)
+    return user_channel(envelope.user_id)
+
+def parse_stream_id(value: str | bytes) -> tuple[int, int] | None:
+    """Parses a Redis stream entry id ("<ms>-<seq>"); None if it is not one."""
+    if isinstance(value, (bytes, bytearray)):
+        value = value.decode(errors="replace")
+    ms, sep, seq = value.partition("-")
+    if not sep or not ms.isdigit() or not seq.isdigit():
+        return None
+    return int(ms), int(seq)
+
+def encode_event(envelope: EventEnvelope, id: str | None = None) -> bytes:
+    """
+    Builds the SSE frame for an event. This is the only serialization on the
+    delivery path; subscribers forward these bytes unchanged.
+    The "id:" line is left out unless given: for replayable user events Redis
+    prepends the stream entry id, and topic events never set one so they do
+    not move the client's Last-Event-ID.
+    """
+    data = envelope.model_dump_json()
+    frame = f"event: {envelope.type}\ndata: {data}\n\n"
+    if id is not None:
+        frame = f"id: {id}\n{frame}"
+    return frame.encode()
+
+async def _send(r: Redis, client, envelope: EventEnvelope, dedupe: str | None = None):
+    """
+    Issues the publish for one event on ``client`` (the connection or a pipeline).
+    ``dedupe`` is the event's idempotency key in Redis (see dedupe_key).
+    """
+    global _publish_script
+
+    ch = event_channel(envelope)
+    # TTL and priority travel as a header line the subscriber strips (buffer.untag)
+    header = frame_header(envelope.expires_at_ms, envelope.priority == "high")
+    if dedupe is not None:
+        return await _send_idempotent(r, client, envelope, ch, dedupe, header)
+    if envelope.user_id is None:
+        return await client.publish(ch, header + encode_event(envelope))
+    if not settings.SSE_REPLAY_ENABLED:
+        return await client.publish(ch, header + encode_event(envelope, id=envelope.id))
+
+    if _publish_script is None:
+        _publish_script = r.register_script(_PUBLISH_LUA)
+    return await _publish_script(
+        keys=[user_stream(envelope.user_id)],
+        args=[settings.SSE_REPLAY_MAXLEN, settings.SSE_REPLAY_TTL_SECONDS, encode_event(envelope), ch,
+              header, envelope.expires_at_ms or ""],
+        client=client,
+    )
+
+async def _send_idempotent(r: Redis, client, envelope: EventEnvelope, ch: str, dedupe: str, header: bytes):
+    global _idempotent_script
+
+    if _idempotent_script is None:
+        _idempotent_script = r.register_script(_IDEMPOTENT_PUBLISH_LUA)
+    window_ms = settings.PUBLISH_IDEMPOTENCY_WINDOW_SECONDS * 1000
+    if envelope.user_id is None:
+        keys, args = [dedupe], [envelope.id, window_ms, header + encode_event(envelope), ch]
+    elif not settings.SSE_REPLAY_ENABLED:
+        keys, args = [dedupe], [envelope.id, window_ms, header + encode_event(envelope, id=envelope.id), ch]
+    else:
+        keys = [dedupe, user_stream(envelope.user_id)]
+        args = [envelope.id, window_ms, encode_event(envelope), ch,
+                settings.SSE_REPLAY_MAXLEN, settings.SSE_REPLAY_TTL_SECONDS, header, envelope.expires_at_ms or ""]
+    return await _idempotent_script(keys=keys, args=args, client=client)
+
+def _duplicate_of(result) -> str | None:
+    """The original event id when an idempotent publish found its key taken."""
+    if isinstance(result, list) and result and result[0] == 0:
+        original = result[1]
+        return original.decode() if isinstance(original, bytes) else original
+    return None
+
+async def publish_event(shards: RedisShards, envelope: EventEnvelope, dedupe: str | None = None) -> str | None:
+    """Publishes one event; with ``dedupe``, returns the original event id if the key was already used."""
+    r = shards.for_channel(event_channel(envelope))
+    started = time.perf_counter()
+    result = await _send(r, r, envelope, dedupe)
+    REDIS_PUBLISH_SECONDS.observe(time.perf_counter() - started)
+    return _duplicate_of(result)
+
+async def _publish_pipeline(r: Redis, items: List[Tuple[EventEnvelope, str | None]]) -> List[object]:
+    async with r.pipeline(transaction=False) as pipe:
+        for envelope, dedupe in items:
+            await _send(r, pipe, envelope, dedupe)
+        started = time.perf_counter()
+        results = await pipe.execute(raise_on_error=False)
+        REDIS_PUBLISH_SECONDS.observe(time.perf_counter() - started)
+        return results
+
+async def publish_events(
+    shards: RedisShards,
+    envelopes: List[EventEnvelope],
+    dedupes: List[str | None] | None = None,
+) -> List[object]:
+    """
+    Publishes many events with one pipeline per shard, the shards in parallel.
+    ``dedupes`` holds an optional idempotency key per envelope. Returns one
+    result per envelope: None when published, the original event id for a
+    duplicate, or the exception raised for that command.
+    """
+    dedupes = dedupes or [None] * len(envelopes)
+    items = zip(envelopes, dedupes)
+    groups = list(shards.group((event_channel(e), (e, d)) for e, d in items).items())
+    outcomes = await asyncio.gather(
+        *(_publish_pipeline(shards.clients[n], [item for _, item in members]) for n, members in groups),
+        return_exceptions=True,
+    )
+    results: List[object] = [None] * len(envelopes)
+    for (_, members), outcome in zip(groups, outcomes):
+        for k, (position, _) in enumerate(members):
+            # a shard that failed as a whole fails each of its events
+            if isinstance(outcome, Exception):
+                results[position] = outcome
+            elif isinstance(outcome[k], Exception):
+                results[position] = outcome[k]
+            else:
+                results[position] = _duplicate_of(outcome[k])
+    return results
+
+async def read_stream_after(shards: RedisShards, user_id: str, after: str, count: int) -> list:
+    """Entries of the user's stream strictly after ``after``, oldest first."""
+    r = shards.for_channel(user_channel(user_id))
+    return await r.xrange(user_stream(user_id), min=f"({after}", max="+", count=count)
@@ -1,7 +1,13 @@
 from app.api.v1.schemas import EventEnvelope
+from app.services.presence import PresenceRegistry
 
 
 
-async def send_push_notification_if_offline(envelope: EventEnvelope) -> None:
+async def send_push_notification_if_offline(presence: PresenceRegistry, envelope: EventEnvelope) -> None:
+    if envelope.user_id is None:
+        # topic events are live-only; push is per user
+        return None
+    if await presence.is_online(envelope.user_id):
+        return None
     # placeholder (FCM/APNS/web-push later)
     return None
@@ -0,0 +1,227 @@
+import asyncio
+import contextlib
+import logging
+import math
+import time
+from collections import OrderedDict
+from typing import Dict, List, Tuple
+from redis.asyncio import Redis
+from redis.commands.core import AsyncScript
+from redis.exceptions import RedisError
+
+from app.api.v1.schemas import EventEnvelope
+from app.services.pubsub import publish_event
+from app.services.shards import RedisShards
+from app.utils.ids import created_at_from_id, new_event_id
+
+
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_EVENT_TYPE = "notify.summary"
+
+# Token bucket in a hash {t: tokens, ts: ms}, refilled from Redis' clock so all
+# workers agree. Takes up to ARGV[3] whole tokens; returns {granted, ms until
+# the next token when the bucket is left empty}.
+_TAKE_LUA = """
+local rate, burst, want = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+local b = redis.call('HMGET', KEYS[1], 't', 'ts')
+local tokens = tonumber(b[1]) or burst
+local ts = tonumber(b[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate / 1000)
+local granted = math.min(want, math.floor(tokens))
+tokens = tokens - granted
+redis.call('HSET', KEYS[1], 't', tostring(tokens), 'ts', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil(burst * 1000 / rate) + 1000)
+local wait = 0
+if tokens < 1 then
+  wait = math.ceil((1 - tokens) * 1000 / rate)
+end
+return {granted, wait}
+"""
+
+# Leased tokens not spent within this time are dropped, so a worker never sits on
+# an old grant
+LEASE_SECONDS = 1.0
+
+
+def user_bucket(user_id: str) -> str:
+    return f"rl:user:{user_id}"
+
+def producer_bucket(producer: str) -> str:
+    return f"rl:producer:{producer}"
+
+
+class RateLimiter:
+    """
+    Token buckets in Redis, consumed through an atomic script. Each worker
+    leases ``batch`` tokens (or 1% of the burst) per bucket at a time and remembers refusals
+    until the next token is due, so a hot key costs a round trip per batch
+    instead of per event, and a flood is refused without touching Redis.
+    Redis errors fail open.
+    """
+
+    MAX_LOCAL_KEYS = 100_000
+
+    def __init__(self, r: Redis, limits: Dict[str, Tuple[float, int]], batch: int):
+        self._r = r
+        self._limits = {kind: limit for kind, limit in limits.items() if limit[0] > 0}
+        self._batch = max(1, batch)
+        self._script: AsyncScript | None = None
+        # bucket -> [leased tokens, lease expiry, refused until] (monotonic)
+        self._local: "OrderedDict[str, List[float]]" = OrderedDict()
+
+    async def take(self, demand: Dict[Tuple[str, str], int]) -> Dict[Tuple[str, str], Tuple[int, float]]:
+        """
+        ``demand`` maps (kind, bucket) to the tokens wanted; kinds without a
+        limit are granted in full. Returns (granted, seconds until the next
+        token when short) per bucket, with one pipelined round trip for the
+        buckets the local leases cannot cover.
+        """
+        now = time.monotonic()
+        result: Dict[Tuple[str, str], Tuple[int, float]] = {}
+        remote: List[Tuple[Tuple[str, str], int, int]] = []
+        for (kind, bucket), want in demand.items():
+            if kind not in self._limits:
+                result[(kind, bucket)] = (want, 0.0)
+                continue
+            entry = self._entry(bucket)
+            if entry[2] > now:
+                result[(kind, bucket)] = (0, entry[2] - now)
+                continue
+            if entry[1] <= now:
+                entry[0] = 0
+            local = min(want, int(entry[0]))
+            entry[0] -= local
+            result[(kind, bucket)] = (local, 0.0)
+            if local < want:
+                remote.append(((kind, bucket), local, want - local))
+        if remote:
+            await self._take_remote(remote, result, now)
+        return result
+
+    async def _take_remote(self, remote, result, now: float) -> None:
+        if self._script is None:
+            self._script = self._r.register_script(_TAKE_LUA)
+        try:
+            async with self._r.pipeline(transaction=False) as pipe:
+                for (kind, bucket), _, short in remote:
+                    rate, burst = self._limits[kind]
+                    # large buckets lease 1% of the burst, so busy producers rarely reach Redis
+                    want = min(burst, max(short, self._batch, burst // 100))
+                    await self._script(keys=[bucket], args=[rate, burst, want], client=pipe)
+                replies = await pipe.execute()
+        except RedisError:
+            logger.warning("rate limit check failed; allowing", exc_info=True)
+            for key, local, short in remote:
+                result[key] = (local + short, 0.0)
+            return
+        for (key, local, short), (granted, wait_ms) in zip(remote, replies):
+            granted, entry = int(granted), self._entry(key[1])
+            used = min(granted, short)
+            # the rest of a batch stays leased to this worker for a while
+            entry[0] = granted - used
+            entry[1] = now + LEASE_SECONDS
+            if used < short:
+                entry[2] = now + int(wait_ms) / 1000
+            result[key] = (local + used, int(wait_ms) / 1000 if used < short else 0.0)
+
+    def _entry(self, bucket: str) -> List[float]:
+        entry = self._local.get(bucket)
+        if entry is None:
+            entry = self._local[bucket] = [0, 0.0, 0.0]
+            if len(self._local) > self.MAX_LOCAL_KEYS:
+                self._local.popitem(last=False)
+        else:
+            self._local.move_to_end(bucket)
+        return entry
+
+
+class StreamThrottle:
+    """
+    In-memory token bucket on new-stream setup for this worker (rate 0
+    disables). After a failover or a balancer restart every client
+    reconnects at once; past the bucket they are turned away before any
+    token check, subscribe or task spawn is paid for.
+    """
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._ts = time.monotonic()
+        self.admitted = 0
+        self.throttled = 0
+
+    def admit(self) -> bool:
+        if self.rate <= 0:
+            self.admitted += 1
+            return True
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._ts) * self.rate)
+        self._ts = now
+        if self._tokens < 1:
+            self.throttled += 1
+            return False
+        self._tokens -= 1
+        self.admitted += 1
+        return True
+
+
+def retry_after_header(seconds: float) -> str:
+    return str(max(1, math.ceil(seconds)))
+
+
+class OverLimitSummarizer:
+    """
+    Collapses over-limit events per target into one "notify.summary" event
+    (counts by type, first and last suppressed ids), published every
+    ``interval`` seconds while events keep being suppressed.
+    """
+
+    def __init__(self, shards: RedisShards, interval: float):
+        self._shards = shards
+        self._interval = interval
+        # (user_id, topic) -> {"suppressed", "types", "first_id", "last_id"}
+        self._pending: Dict[Tuple[str | None, str | None], dict] = {}
+        self._task: asyncio.Task | None = None
+
+    async def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._task
+        await self.flush()
+
+    def add(self, envelope: EventEnvelope) -> None:
+        summary = self._pending.get((envelope.user_id, envelope.topic))
+        if summary is None:
+            summary = self._pending[(envelope.user_id, envelope.topic)] = {
+                "suppressed": 0, "types": {}, "first_id": envelope.id, "last_id": envelope.id,
+            }
+        summary["suppressed"] += 1
+        summary["types"][envelope.type] = summary["types"].get(envelope.type, 0) + 1
+        summary["last_id"] = envelope.id
+
+    async def flush(self) -> None:
+        pending, self._pending = self._pending, {}
+        for (user_id, topic), summary in pending.items():
+            event_id = new_event_id()
+            envelope = EventEnvelope(
+                id=event_id, type=SUMMARY_EVENT_TYPE, user_id=user_id, topic=topic,
+                data=summary, created_at=created_at_from_id(event_id),
+            )
+            try:
+                await publish_event(self._shards, envelope)
+            except RedisError:
+                logger.warning("publishing a rate limit summary failed", exc_info=True)
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self._interval)
+            await self.flush()
@@ -0,0 +1,54 @@
+import hashlib
+from bisect import bisect
+from typing import Dict, Iterable, List, Sequence, Tuple
+import redis.asyncio as redis
+
+
+
+def _point(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), "big")
+
+
+class RedisShards:
+    """
+    Client-side consistent hashing of pub/sub channels over several Redis
+    nodes. A channel and the keys that travel with it (a user's replay
+    stream) live on the channel's shard, so each publish is a single-node
+    operation and pub/sub traffic splits across nodes instead of being
+    broadcast to all of them as it would be on a Redis Cluster bus.
+
+    Nodes are placed on the ring by URL, so adding one moves roughly 1/N of
+    the channels; replay history of moved users stays behind on the old node.
+    """
+
+    def __init__(self, urls: Sequence[str], vnodes: int = 512, **kwargs):
+        if not urls:
+            raise ValueError("At least one Redis URL is required")
+        self.urls = list(urls)
+        self.clients: List[redis.Redis] = [redis.Redis.from_url(url, **kwargs) for url in self.urls]
+        ring = sorted((_point(f"{url}#{i}"), n) for n, url in enumerate(self.urls) for i in range(vnodes))
+        self._points = [p for p, _ in ring]
+        self._owners = [n for _, n in ring]
+
+    def __len__(self) -> int:
+        return len(self.clients)
+
+    def index_for(self, channel: str) -> int:
+        if len(self.clients) == 1:
+            return 0
+        i = bisect(self._points, _point(channel))
+        return self._owners[i % len(self._owners)]
+
+    def for_channel(self, channel: str) -> redis.Redis:
+        return self.clients[self.index_for(channel)]
+
+    def group(self, items: Iterable[Tuple[str, object]]) -> Dict[int, List[Tuple[int, object]]]:
+        """Splits (channel, item) pairs by shard, keeping each item's position."""
+        groups: Dict[int, List[Tuple[int, object]]] = {}
+        for position, (channel, item) in enumerate(items):
+            groups.setdefault(self.index_for(channel), []).append((position, item))
+        return groups
+
+    async def aclose(self) -> None:
+        for client in self.clients:
+            await client.aclose()
@@ -1,13 +1,24 @@
 import asyncio
 import json
-import contextlib
-from typing import AsyncGenerator
-from redis.asyncio import Redis
+import random
+import time
+from contextlib import aclosing
+from typing import AsyncGenerator, List, Sequence, Set
 
 from app.core.config import settings
+from app.services.pubsub import parse_stream_id, read_stream_after, topic_channel, user_channel
+from app.services.buffer import ConnectionBuffer
+from app.services.connections import CLOSED_EVENT_ID, DRAINING, SESSION_CLOSE_REASONS, ConnectionRegistry
+from app.services.metrics import EVENTS_DELIVERED, HEARTBEATS, SSE_QUEUE_DEPTH
+from app.services.presence import PresenceRegistry
+from app.services.shards import RedisShards
+from app.services.subscriber import ShardedSubscriber
 
 
 
+CLOSED_RETRY_MILLISECONDS = 3_600_000
+
+
 def _format_sse(data: str, event: str | None = None, id: str | None = None, retry_ms: int | None = None) -> str:
     lines = []
     if id is not None:
@@ -21,66 +32,197 @@ def _format_sse(data: str, event: str | None = None, id: str | None = None, retr
     lines.append("")  # end of message
     return "\n".join(lines) + "\n"
 
+def control_frame(event: str, payload: dict) -> bytes:
+    """Out-of-band frame for this connection only (e.g. replies to WebSocket ops)."""
+    return _format_sse(json.dumps(payload, separators=(",", ":")), event=event).encode()
+
+def _closed_frame(reason: str) -> bytes:
+    # a long retry, in case the client ignores "closed" and the 204 alike
+    payload = json.dumps({"reason": reason}, separators=(",", ":"))
+    return _format_sse(payload, event="closed", id=CLOSED_EVENT_ID, retry_ms=CLOSED_RETRY_MILLISECONDS).encode()
+
 def _heartbeat() -> str:
     return ":\n\n"
 
-async def sse_event_stream(r: Redis, user_id: str, request) -> AsyncGenerator[bytes, None]:
+def _resume_hint(retry_ms: int, reason: str = "slow-consumer") -> str:
+    # the client reconnects after retry_ms and catches up through Last-Event-ID
+    return _format_sse(reason, event="resume", retry_ms=retry_ms)
+
+def _skip_replayed(frames: List[bytes], replayed_upto: tuple[int, int]) -> tuple[List[bytes], tuple[int, int] | None]:
+    """Drops live frames the replay already sent; returns the rest and the cursor (None once caught up)."""
+    for i, frame in enumerate(frames):
+        if not frame.startswith(b"id: "):
+            continue
+        entry = parse_stream_id(frame[4:frame.index(b"\n")])
+        if entry is not None and entry <= replayed_upto:
+            continue
+        # live stream has caught up: keep this frame and everything after it
+        return [f for f in frames[:i] if not f.startswith(b"id: ")] + frames[i:], None
+    return [f for f in frames if not f.startswith(b"id: ")], replayed_upto
+
+async def _watch_disconnect(request, buffer: ConnectionBuffer) -> None:
+    """Waits on the ASGI receive channel and wakes the stream when the client goes away."""
+    while True:
+        message = await request.receive()
+        if message["type"] == "http.disconnect":
+            buffer.close("disconnected")
+            return
+
+def stream_channels(user_id: str, topics: Sequence[str] = ()) -> List[str]:
+    """The user's channel, the broadcast topic and any requested topics."""
+    channels = [user_channel(user_id), topic_channel(settings.BROADCAST_TOPIC)]
+    channels += [topic_channel(t) for t in topics if t != settings.BROADCAST_TOPIC]
+    return channels
+
+def new_buffer() -> ConnectionBuffer:
+    return ConnectionBuffer(
+        max_events=settings.SSE_BUFFER_MAX_EVENTS,
+        max_bytes=settings.SSE_BUFFER_MAX_BYTES,
+        policy=settings.SSE_SLOW_CONSUMER_POLICY,
+    )
+
+async def deliver(
+    shards: RedisShards,
+    subscriber: ShardedSubscriber,
+    presence: PresenceRegistry,
+    connections: ConnectionRegistry,
+    user_id: str,
+    buffer: ConnectionBuffer,
+    channels: Set[str],
+    last_event_id: str | None = None,
+    transport: str = "sse",
+) -> AsyncGenerator[bytes, None]:
     """
-    Subscribes to Redis pubsub channel for user and streams SSE.
-    Sends heartbeats.
+    Transport-neutral delivery: yields ready-to-write chunks of SSE-framed
+    events for one connection until ``buffer`` is closed. Subscribes
+    ``channels`` first; the caller may add channels later (subscribing them on
+    ``buffer``), and whatever the set holds at the end is unsubscribed.
+    With a Last-Event-ID, first replays the user's missed events from Redis.
+    A session closed from outside (evicted by the per-user cap, or an admin
+    disconnect) ends with a "closed" frame carrying the reason; its id makes a
+    reconnect from the same EventSource get 204.
     """
-    pubsub = r.pubsub()
-    channel = f"user:{user_id}"
-    await pubsub.subscribe(channel)
-
     heartbeat_interval = settings.SSE_HEARTBEAT_SECONDS
     retry_ms = settings.SSE_RETRY_MILLISECONDS
+    coalesce_window = settings.SSE_WRITE_COALESCE_MILLISECONDS / 1000
+    coalesce_bytes = settings.SSE_WRITE_COALESCE_BYTES
 
-    queue: asyncio.Queue[str] = asyncio.Queue()
-
-    async def reader():
-        try:
-            async for msg in pubsub.listen():
-                if msg is None:
-                    continue
-                if msg.get("type") != "message":
-                    continue
-                data = msg.get("data")
-                if isinstance(data, (bytes, bytearray)):
-                    data = data.decode()
-                try:
-                    payload = json.loads(data)
-                    event_type = payload.get("type", "message")
-                    event_id = payload.get("id")
-                    sse = _format_sse(json.dumps(payload), event=event_type, id=event_id)
-                except Exception:
-                    sse = _format_sse(str(data))
-                await queue.put(sse)
-        finally:
-            await pubsub.unsubscribe(channel)
-
-    reader_task = asyncio.create_task(reader())
-
-    # Initial retry hint
-    yield _format_sse("stream-open", event="ready", retry_ms=retry_ms).encode()
+    online = False
+    session = None
 
     try:
-        last_hb = asyncio.get_event_loop().time()
+        for channel in list(channels):
+            await subscriber.subscribe(channel, buffer)
+        await presence.connect(user_id)
+        online = True
+        session = await connections.open(user_id, buffer, channels, transport)
+
+        # Initial retry hint
+        yield _format_sse("stream-open", event="ready", retry_ms=retry_ms).encode()
+
+        # subscribe() returned on Redis' confirmation, before the stream is read, so
+        # nothing falls in between; live frames the replay covers are skipped below.
+        replayed_upto = None
+        if settings.SSE_REPLAY_ENABLED and last_event_id and parse_stream_id(last_event_id):
+            page_size = settings.SSE_REPLAY_PAGE_SIZE
+            after = last_event_id
+            while True:
+                entries = await read_stream_after(shards, user_id, after, page_size)
+                if entries:
+                    # events published with a ttl_ms carry their expiry as "x"
+                    now_ms = time.time() * 1000
+                    live = [(entry_id, fields) for entry_id, fields in entries
+                            if b"x" not in fields or int(fields[b"x"]) > now_ms]
+                    if live:
+                        EVENTS_DELIVERED.inc(len(live))
+                        yield b"".join(b"id: " + entry_id + b"\n" + fields[b"f"] for entry_id, fields in live)
+                    after = entries[-1][0].decode()
+                    replayed_upto = parse_stream_id(after)
+                if len(entries) < page_size:
+                    break
+
+        loop = asyncio.get_running_loop()
+        next_hb = loop.time() + heartbeat_interval
         while True:
-            if await request.is_disconnected():
+            try:
+                async with asyncio.timeout_at(next_hb):
+                    data = await buffer.get()
+            except TimeoutError:
+                HEARTBEATS.inc()
+                yield _heartbeat().encode()
+                next_hb = loop.time() + heartbeat_interval
+                continue
+
+            if data is None:
+                if buffer.closed_reason == "overflow":
+                    yield _resume_hint(retry_ms).encode()
+                elif buffer.closed_reason == DRAINING:
+                    # a random retry per client spreads the reconnects of a draining worker
+                    retry = random.randint(settings.SSE_DRAIN_RETRY_MIN_MS, settings.SSE_DRAIN_RETRY_MAX_MS)
+                    yield _resume_hint(retry, reason=DRAINING).encode()
+                elif buffer.closed_reason in SESSION_CLOSE_REASONS:
+                    yield _closed_frame(buffer.closed_reason)
                 break
 
-            try:
-                item = await asyncio.wait_for(queue.get(), timeout=1.0)
-                yield item.encode()
-            except asyncio.TimeoutError:
-                pass
+            # Whatever is already pending, plus (with a coalescing window) what
+            # arrives within it, goes out as one write: one ASGI send, one syscall.
+            # A byte cap of 0 turns this off.
+            SSE_QUEUE_DEPTH.observe(buffer.qsize() + 1)
+            chunk = [data]
+            size = len(data)
+            deadline = loop.time() + coalesce_window
+            while size < coalesce_bytes:
+                data = buffer.get_nowait()
+                if data is None:
+                    if buffer.closed_reason is not None or loop.time() >= deadline:
+                        break
+                    try:
+                        async with asyncio.timeout_at(deadline):
+                            data = await buffer.get()
+                    except TimeoutError:
+                        break
+                    if data is None:
+                        break
+                chunk.append(data)
+                size += len(data)
 
-            now = asyncio.get_event_loop().time()
-            if now - last_hb >= heartbeat_interval:
-                yield _heartbeat().encode()
-                last_hb = now
+            if replayed_upto is not None:
+                chunk, replayed_upto = _skip_replayed(chunk, replayed_upto)
+                if not chunk:
+                    continue
+            # frames arrive fully encoded by the publisher (see pubsub.encode_event)
+            EVENTS_DELIVERED.inc(len(chunk))
+            yield chunk[0] if len(chunk) == 1 else b"".join(chunk)
+            # any write keeps the connection alive, so push the heartbeat back
+            next_hb = loop.time() + heartbeat_interval
+    finally:
+        if session is not None:
+            await connections.close(session)
+        if online:
+            await presence.disconnect(user_id)
+        for channel in list(channels):
+            await subscriber.unsubscribe(channel, buffer)
+
+async def sse_event_stream(
+    shards: RedisShards,
+    subscriber: ShardedSubscriber,
+    presence: PresenceRegistry,
+    connections: ConnectionRegistry,
+    user_id: str,
+    request,
+    topics: Sequence[str] = (),
+    last_event_id: str | None = None,
+) -> AsyncGenerator[bytes, None]:
+    """
+    SSE transport over ``deliver``: the response body is the chunks as-is,
+    and the ASGI receive channel tells us when the client goes away.
+    """
+    buffer = new_buffer()
+    channels = set(stream_channels(user_id, topics))
+    watcher = asyncio.create_task(_watch_disconnect(request, buffer))
+    try:
+        async with aclosing(deliver(shards, subscriber, presence, connections, user_id, buffer, channels, last_event_id)) as chunks:
+            async for chunk in chunks:
+                yield chunk
     finally:
-        reader_task.cancel()
-        with contextlib.suppress(Exception): # to avoid CancelledError
-            await reader_task
+        watcher.cancel()
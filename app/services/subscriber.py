@@ -0,0 +1,169 @@
+import asyncio
+import contextlib
+import logging
+from typing import Dict, Set
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+
+from app.services.buffer import ConnectionBuffer, untag
+from app.services.shards import RedisShards
+
+
+
+logger = logging.getLogger(__name__)
+
+# a listener is registered only once Redis confirms the SUBSCRIBE, within this time
+SUBSCRIBE_ACK_TIMEOUT_SECONDS = 5.0
+
+
+class SharedSubscriber:
+    """
+    One Redis pubsub connection per worker, shared by every local stream.
+    Channels are subscribed on first local listener and unsubscribed when the
+    last one leaves; incoming messages are routed to the listeners' buffers.
+    ``subscribe()`` returns once Redis has confirmed the subscription (not
+    just once SUBSCRIBE is written), so a stream read that follows misses
+    nothing published after it. Listeners that join while the first
+    SUBSCRIBE is in flight wait for the same confirmation, and all of them
+    fail together if it does not come.
+    """
+
+    def __init__(self, r: Redis):
+        self._pubsub = r.pubsub()
+        self._local: Dict[str, Set[ConnectionBuffer]] = {}
+        # channels whose first SUBSCRIBE is not confirmed yet; resolved by the reader
+        self._pending: Dict[str, asyncio.Future] = {}
+        self._cleanups: Set[asyncio.Task] = set()
+        self._lock = asyncio.Lock()  # keeps SUBSCRIBE/UNSUBSCRIBE in call order
+        self._active = asyncio.Event()
+        self._task: asyncio.Task | None = None
+
+    async def start(self) -> None:
+        self._task = asyncio.create_task(self._reader())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._task
+        with contextlib.suppress(Exception):
+            await self._pubsub.aclose()
+
+    def channel_count(self) -> int:
+        return len(self._local)
+
+    async def subscribe(self, channel: str, buffer: ConnectionBuffer) -> None:
+        buffers = self._local.get(channel)
+        if buffers is not None:
+            buffers.add(buffer)
+            pending = self._pending.get(channel)
+            if pending is not None:
+                # fails with the first listener's error if its SUBSCRIBE does
+                await asyncio.shield(pending)
+            return
+
+        self._local[channel] = {buffer}
+        pending = self._pending[channel] = asyncio.get_running_loop().create_future()
+        try:
+            async with self._lock:
+                await self._pubsub.subscribe(channel)
+            self._active.set()
+            async with asyncio.timeout(SUBSCRIBE_ACK_TIMEOUT_SECONDS):
+                await asyncio.shield(pending)
+        except BaseException as exc:
+            # nobody is subscribed: drop every listener that joined meanwhile, not just this one
+            if buffer in self._local.get(channel, ()):
+                del self._local[channel]
+            if not isinstance(exc, Exception):  # cancelled: the waiters still need an error
+                exc = RedisError(f"subscribe to {channel} was interrupted")
+            if not pending.done():
+                pending.set_exception(exc)
+                pending.exception()  # retrieved here, so a lone listener leaves no warning
+            # the SUBSCRIBE may have gone out (and be confirmed late): undo it, off the
+            # caller's path since the caller may be cancelled
+            cleanup = asyncio.create_task(self._unsubscribe_unused(channel))
+            self._cleanups.add(cleanup)
+            cleanup.add_done_callback(self._cleanups.discard)
+            raise
+        finally:
+            if self._pending.get(channel) is pending:
+                del self._pending[channel]
+
+    async def unsubscribe(self, channel: str, buffer: ConnectionBuffer) -> None:
+        if self._discard(channel, buffer):
+            await self._unsubscribe_unused(channel)
+
+    async def _unsubscribe_unused(self, channel: str) -> None:
+        try:
+            async with self._lock:
+                # a new listener may have arrived while we waited for the lock
+                if channel not in self._local:
+                    await self._pubsub.unsubscribe(channel)
+        except RedisError:
+            logger.warning("failed to unsubscribe from %s", channel, exc_info=True)
+
+    def _discard(self, channel: str, buffer: ConnectionBuffer) -> bool:
+        """Remove a listener; returns True when the channel has no listeners left."""
+        buffers = self._local.get(channel)
+        if buffers is None:
+            return False
+        buffers.discard(buffer)
+        if buffers:
+            return False
+        del self._local[channel]
+        return True
+
+    def _dispatch(self, channel: str, data) -> None:
+        data = untag(data)  # once per message, not per listener
+        for buffer in self._local.get(channel, ()):
+            buffer.put_nowait(data)
+
+    async def _reader(self) -> None:
+        await self._active.wait()
+        while True:
+            try:
+                msg = await self._pubsub.get_message(timeout=None)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                # redis-py reconnects and resubscribes on the next read
+                logger.warning("pubsub reader error, retrying", exc_info=True)
+                await asyncio.sleep(1.0)
+                continue
+            if msg is None or msg.get("type") not in ("message", "subscribe"):
+                continue
+            channel = msg["channel"]
+            if isinstance(channel, (bytes, bytearray)):
+                channel = channel.decode()
+            if msg["type"] == "subscribe":
+                # also seen on resubscribes after a reconnect, with nothing pending
+                pending = self._pending.get(channel)
+                if pending is not None and not pending.done():
+                    pending.set_result(None)
+                continue
+            self._dispatch(channel, msg["data"])
+
+
+class ShardedSubscriber:
+    """One SharedSubscriber per Redis shard; each channel is followed on its own shard."""
+
+    def __init__(self, shards: RedisShards):
+        self._shards = shards
+        self._subscribers = [SharedSubscriber(client) for client in shards.clients]
+
+    async def start(self) -> None:
+        for subscriber in self._subscribers:
+            await subscriber.start()
+
+    async def stop(self) -> None:
+        for subscriber in self._subscribers:
+            await subscriber.stop()
+
+    def channel_count(self) -> int:
+        return sum(s.channel_count() for s in self._subscribers)
+
+    async def subscribe(self, channel: str, buffer: ConnectionBuffer) -> None:
+        await self._subscribers[self._shards.index_for(channel)].subscribe(channel, buffer)
+
+    async def unsubscribe(self, channel: str, buffer: ConnectionBuffer) -> None:
+        await self._subscribers[self._shards.index_for(channel)].unsubscribe(channel, buffer)
@@ -1,11 +1,86 @@
+import os
+import socket
 import time
-import uuid
 from datetime import datetime, timezone
 
 
 
+# Snowflake layout: 41 bits of ms since EPOCH_MS | 10 bits worker | 12 bits sequence
+EPOCH_MS = 1704067200000  # 2024-01-01T00:00:00Z
+WORKER_BITS = 10
+SEQUENCE_BITS = 12
+MAX_WORKER = (1 << WORKER_BITS) - 1
+MAX_SEQUENCE = (1 << SEQUENCE_BITS) - 1
+_TIME_SHIFT = WORKER_BITS + SEQUENCE_BITS
+_TIME_MASK = (1 << 41) - 1
+# top bit marks the format; it also keeps new ids sorting after the legacy "<ms>-<hex>" ones
+_MARKER = 1 << 63
+
+
+class EventIdGenerator:
+    """
+    Snowflake-style ids, strictly increasing per worker and sortable across the
+    cluster. When the clock steps back or a millisecond's 4096 ids run out, the
+    generator borrows the next millisecond instead of waiting.
+    """
+
+    def __init__(self, worker: int = 0):
+        if not 0 <= worker <= MAX_WORKER:
+            raise ValueError(f"worker must be in 0..{MAX_WORKER}")
+        self.worker = worker
+        self._last_ms = 0
+        self._seq = 0
+
+    def next_value(self) -> int:
+        now = int(time.time() * 1000) - EPOCH_MS
+        if now > self._last_ms:
+            self._last_ms = now
+            self._seq = 0
+        else:
+            self._seq += 1
+            if self._seq > MAX_SEQUENCE:
+                self._last_ms += 1
+                self._seq = 0
+        return _MARKER | (self._last_ms << _TIME_SHIFT) | (self.worker << SEQUENCE_BITS) | self._seq
+
+
+_ALPHABET = "0123456789ABCDEFGHIJKLMNOPQRSTUV"  # base32hex: ASCII order, and what int(s, 32) reads
+_PAIRS = [a + b for a in _ALPHABET for b in _ALPHABET]
+
+def encode_id(value: int) -> str:
+    """13 chars of base32hex, so string order is numeric order."""
+    v = value << 1  # 65 bits: one 5-bit char, then six 10-bit pairs
+    return (
+        _ALPHABET[v >> 60] + _PAIRS[(v >> 50) & 1023] + _PAIRS[(v >> 40) & 1023] + _PAIRS[(v >> 30) & 1023]
+        + _PAIRS[(v >> 20) & 1023] + _PAIRS[(v >> 10) & 1023] + _PAIRS[v & 1023]
+    )
+
+def id_timestamp_ms(event_id: str) -> int:
+    value = int(event_id, 32) >> 1  # 13 chars carry 65 bits; the last one is padding
+    return ((value >> _TIME_SHIFT) & _TIME_MASK) + EPOCH_MS
+
+
+_generator = EventIdGenerator()
+_iso_ms = -1
+_iso = ""
+
+def configure_event_ids(worker: int) -> None:
+    """Called once per worker process, with a worker number unique in the cluster."""
+    global _generator
+    _generator = EventIdGenerator(worker)
+
 def new_event_id() -> str:
-    return f"{int(time.time()*1000)}-{uuid.uuid4().hex[:8]}"
+    return encode_id(_generator.next_value())
+
+def created_at_from_id(event_id: str) -> str:
+    """ISO timestamp of the id's millisecond; formatted once per millisecond."""
+    global _iso_ms, _iso
+    ms = id_timestamp_ms(event_id)
+    if ms != _iso_ms:
+        _iso = datetime.fromtimestamp(ms / 1000, timezone.utc).isoformat(timespec="milliseconds")
+        _iso_ms = ms
+    return _iso
 
-def now_iso() -> str:
-    return datetime.now(timezone.utc).isoformat()
+def worker_id() -> str:
+    # resolved per call: with preload_app the module is imported before the fork
+    return f"{socket.gethostname()}:{os.getpid()}"
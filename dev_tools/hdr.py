@@ -0,0 +1,123 @@
+"""
+Fixed-memory latency histogram in the HdrHistogram layout: log2 buckets split
+into linear sub-buckets, so every recorded value keeps ``digits`` significant
+decimal digits and memory does not grow with the sample count. Values are
+integers (the benchmarks record microseconds). Histograms merge and serialize,
+so worker processes can ship interval histograms to a parent.
+"""
+
+import math
+
+
+
+class Histogram:
+    def __init__(self, highest: int = 60_000_000, digits: int = 2):
+        self.highest = highest
+        self.digits = digits
+        self.sub_bits = max(1, math.ceil(math.log2(2 * 10 ** digits)))
+        self.half_bits = self.sub_bits - 1
+        self.half = 1 << self.half_bits
+        buckets, limit = 1, 1 << self.sub_bits
+        while limit <= highest:
+            limit <<= 1
+            buckets += 1
+        self.counts = [0] * ((buckets + 1) * self.half)
+        self.total = 0
+        self.sum = 0
+        self.min = None
+        self.max = 0
+
+    def _index(self, value: int) -> int:
+        bucket = max(value.bit_length() - self.sub_bits, 0)
+        sub = value >> bucket
+        return ((bucket + 1) << self.half_bits) + sub - self.half
+
+    def _highest_equivalent(self, index: int) -> int:
+        bucket = (index >> self.half_bits) - 1
+        sub = (index & (self.half - 1)) + self.half
+        if bucket < 0:
+            bucket, sub = 0, sub - self.half
+        return ((sub + 1) << bucket) - 1
+
+    def record(self, value: int, count: int = 1) -> None:
+        value = min(max(int(value), 0), self.highest)
+        self.counts[self._index(value)] += count
+        self.total += count
+        self.sum += value * count
+        self.max = max(self.max, value)
+        self.min = value if self.min is None else min(self.min, value)
+
+    def record_corrected(self, value: int, expected_interval: int) -> None:
+        """
+        For closed-loop callers: back-fills the samples a stalled request kept
+        from being sent (HdrHistogram's recordValueWithExpectedInterval).
+        Open-loop callers measure from the intended send time instead.
+        """
+        self.record(value)
+        if expected_interval <= 0:
+            return
+        missing = value - expected_interval
+        while missing >= expected_interval:
+            self.record(missing)
+            missing -= expected_interval
+
+    def percentile(self, p: float) -> int:
+        if not self.total:
+            return 0
+        target = max(1, math.ceil(p / 100 * self.total))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= target:
+                return min(self._highest_equivalent(index), self.max)
+        return self.max
+
+    def mean(self) -> float:
+        return self.sum / self.total if self.total else 0.0
+
+    def merge(self, other: "Histogram") -> None:
+        for index, count in enumerate(other.counts):
+            if count:
+                self.counts[index] += count
+        self.total += other.total
+        self.sum += other.sum
+        self.max = max(self.max, other.max)
+        if other.min is not None:
+            self.min = other.min if self.min is None else min(self.min, other.min)
+
+    def reset(self) -> None:
+        self.counts = [0] * len(self.counts)
+        self.total = self.sum = self.max = 0
+        self.min = None
+
+    def to_dict(self) -> dict:
+        """Sparse form, small enough to pass between processes every interval."""
+        return {
+            "highest": self.highest,
+            "digits": self.digits,
+            "counts": {i: c for i, c in enumerate(self.counts) if c},
+            "total": self.total,
+            "sum": self.sum,
+            "min": self.min,
+            "max": self.max,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Histogram":
+        h = cls(data["highest"], data["digits"])
+        for index, count in data["counts"].items():
+            h.counts[int(index)] = count
+        h.total, h.sum, h.min, h.max = data["total"], data["sum"], data["min"], data["max"]
+        return h
+
+    def summary(self, scale: float = 1000.0) -> dict:
+        """Percentiles divided by ``scale`` (µs -> ms by default)."""
+        return {
+            "count": self.total,
+            "mean": round(self.mean() / scale, 3),
+            "p50": round(self.percentile(50) / scale, 3),
+            "p90": round(self.percentile(90) / scale, 3),
+            "p99": round(self.percentile(99) / scale, 3),
+            "p99.9": round(self.percentile(99.9) / scale, 3),
+            "max": round(self.max / scale, 3),
+        }
@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+
+"""
+In-process benchmark and regression check: runs ``create_app()`` against
+fakeredis, so it needs no server and no Redis. Measures
+	•	_format_sse and encode_event (ns/op)
+	•	event id + created_at generation vs the legacy ms-uuid ids (ns/op)
+	•	publish_event (ops/s, p50/p99)
+	•	the publish route over ASGI (req/s, p50/p99)
+	•	fan-out of topic events to N simulated SSE clients (deliveries/s, p50/p99 publish-to-client)
+	•	Python heap per idle SSE connection (tracemalloc), plain and gzip-compressed
+
+Absolute numbers say little about production (fakeredis runs in the same
+process); they are for spotting regressions between commits on one machine.
+
+Example usage:
+``python dev_tools/inprocess_benchmark.py --save dev_tools/baselines/inprocess.json``
+``python dev_tools/inprocess_benchmark.py --compare dev_tools/baselines/inprocess.json --threshold 0.35``
+"""
+
+import argparse, asyncio, gc, json, os, platform, re, sys, time, tracemalloc, uuid
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+os.environ.setdefault("PERSISTENCE_BACKEND", "none")
+os.environ.setdefault("SSE_HEARTBEAT_SECONDS", "3600")
+
+import fakeredis, httpx
+import redis.asyncio as redis
+
+# every client the app creates talks to one shared in-memory server
+_server = fakeredis.FakeServer()
+redis.Redis.from_url = classmethod(lambda cls, url, **kw: fakeredis.FakeAsyncRedis(server=_server, **kw))
+
+from app.main import create_app, lifespan
+from app.api.v1.schemas import EventEnvelope
+from app.services.compression import StreamCompressor, compress_stream
+from app.services.pubsub import encode_event, publish_event
+from app.services.sse_manager import _format_sse, sse_event_stream
+from app.utils.ids import created_at_from_id, new_event_id
+
+SEQ = re.compile(rb'"seq":(\d+)')
+
+def envelope(i: int, user_id: str | None = "1", topic: str | None = None) -> EventEnvelope:
+    event_id = new_event_id()
+    return EventEnvelope(
+        id=event_id, type="order.updated", user_id=user_id, topic=topic,
+        data={"seq": i, "order_id": 1000 + i, "status": "shipped"},
+        permalink="https://example.com/orders/1", created_at=created_at_from_id(event_id),
+    )
+
+def summarize(samples: list, elapsed: float, count: int, rate_key: str = "ops_per_sec") -> dict:
+    samples.sort()
+    return {
+        rate_key: round(count / elapsed, 1),
+        "p50_us": round(samples[len(samples) // 2] * 1e6, 1),
+        "p99_us": round(samples[min(len(samples) - 1, int(len(samples) * 0.99))] * 1e6, 1),
+    }
+
+class IdleRequest:
+    """What sse_event_stream needs from a request: a receive channel that disconnects on demand."""
+    def __init__(self):
+        self._gone = asyncio.Event()
+    async def receive(self):
+        await self._gone.wait()
+        return {"type": "http.disconnect"}
+    def disconnect(self):
+        self._gone.set()
+
+def open_stream(app, user_id: str, request: IdleRequest):
+    s = app.state
+    return sse_event_stream(s.shards, s.subscriber, s.presence, s.connections, user_id, request)
+
+# ---- benchmarks ----
+def bench_format(n: int) -> dict:
+    data = json.dumps({"id": "x", "type": "t", "data": {"a": 1}})
+    t0 = time.perf_counter()
+    for _ in range(n):
+        _format_sse(data, event="order.updated", id="1-0")
+    fmt = (time.perf_counter() - t0) / n
+    env = envelope(0)
+    t0 = time.perf_counter()
+    for _ in range(n):
+        encode_event(env)
+    enc = (time.perf_counter() - t0) / n
+    return {"format_sse_ns": round(fmt * 1e9), "encode_event_ns": round(enc * 1e9)}
+
+def bench_ids(n: int) -> dict:
+    """Id plus created_at per event: the Snowflake generator against the ms-uuid ids it replaced."""
+    t0 = time.perf_counter()
+    for _ in range(n):
+        event_id = new_event_id()
+        created_at_from_id(event_id)
+    snowflake = (time.perf_counter() - t0) / n
+    t0 = time.perf_counter()
+    for _ in range(n):
+        f"{int(time.time()*1000)}-{uuid.uuid4().hex[:8]}"
+        datetime.now(timezone.utc).isoformat()
+    legacy = (time.perf_counter() - t0) / n
+    return {"event_id_ns": round(snowflake * 1e9), "legacy_event_id_ns": round(legacy * 1e9)}
+
+async def bench_publish_event(app, n: int) -> dict:
+    r = app.state.shards
+    samples = []
+    t0 = time.perf_counter()
+    for i in range(n):
+        env = envelope(i, user_id=str(i % 100))
+        t = time.perf_counter()
+        await publish_event(r, env)
+        samples.append(time.perf_counter() - t)
+    return summarize(samples, time.perf_counter() - t0, n)
+
+async def bench_publish_route(app, n: int) -> dict:
+    samples = []
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        t0 = time.perf_counter()
+        for i in range(n):
+            body = {"type": "order.updated", "user_id": str(i % 100), "data": {"seq": i}}
+            t = time.perf_counter()
+            res = await client.post("/api/v1/internal/notify/publish", json=body)
+            samples.append(time.perf_counter() - t)
+            if res.status_code != 202:
+                raise RuntimeError(f"publish route returned {res.status_code}: {res.text}")
+    return summarize(samples, time.perf_counter() - t0, n, "req_per_sec")
+
+async def bench_fanout(app, clients: int, events: int) -> dict:
+    """Topic events to `clients` streams; latency is publish call start to the frame leaving the stream."""
+    sent_at: dict = {}
+    samples: list = []
+    remaining = clients * events
+    done = asyncio.Event()
+
+    async def consume(stream):
+        nonlocal remaining
+        await stream.__anext__()  # ready frame
+        async for chunk in stream:
+            now = time.perf_counter()
+            for m in SEQ.finditer(chunk):
+                samples.append(now - sent_at[int(m.group(1))])
+                remaining -= 1
+            if remaining <= 0:
+                done.set()
+
+    requests = [IdleRequest() for _ in range(clients)]
+    streams = [open_stream(app, f"fan{i}", req) for i, req in enumerate(requests)]
+    tasks = [asyncio.create_task(consume(s)) for s in streams]
+    while app.state.connections.active < clients:
+        await asyncio.sleep(0.01)
+
+    r = app.state.shards
+    t0 = time.perf_counter()
+    for i in range(events):
+        sent_at[i] = time.perf_counter()
+        await publish_event(r, envelope(i, user_id=None, topic="broadcast"))
+    await asyncio.wait_for(done.wait(), timeout=60)
+    elapsed = time.perf_counter() - t0
+
+    for req in requests:
+        req.disconnect()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    for s in streams:
+        await s.aclose()
+    return summarize(samples, elapsed, len(samples), "deliveries_per_sec")
+
+async def bench_idle_memory(app, n: int, compressed: bool = False) -> int:
+    """Bytes per idle stream; compressed streams carry a gzip context as the stream route would."""
+    requests = [IdleRequest() for _ in range(n)]
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    streams = [open_stream(app, f"idle{i}", req) for i, req in enumerate(requests)]
+    if compressed:
+        streams = [compress_stream(s, StreamCompressor("gzip")) for s in streams]
+    for s in streams:
+        await s.__anext__()  # registered, subscribed and waiting
+    gc.collect()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    grown = sum(stat.size_diff for stat in after.compare_to(before, "filename"))
+    for req in requests:
+        req.disconnect()
+    for s in streams:
+        await s.aclose()
+    return int(grown / n)
+
+async def run(args) -> dict:
+    results = {"format": bench_format(args.format_iterations), "ids": bench_ids(args.format_iterations)}
+    app = create_app()
+    async with lifespan(app):
+        results["publish_event"] = await bench_publish_event(app, args.publish)
+        results["publish_route"] = await bench_publish_route(app, args.route)
+        results["fanout"] = await bench_fanout(app, args.clients, args.events)
+        results["idle_connection"] = {
+            "bytes_per_conn": await bench_idle_memory(app, args.idle),
+            "bytes_per_compressed_conn": await bench_idle_memory(app, args.idle, compressed=True),
+        }
+    return results
+
+def median_of(runs: list) -> dict:
+    """Per metric, the median across runs: one slow or lucky run does not move it."""
+    median = {}
+    for bench in runs[0]:
+        median[bench] = {}
+        for key in runs[0][bench]:
+            values = sorted(r[bench][key] for r in runs)
+            median[bench][key] = values[len(values) // 2]
+    return median
+
+# ---- baselines ----
+# p99 of a few hundred samples is mostly noise, and the legacy ids are only a
+# reference: both are reported but never fail a comparison
+UNGATED = ("p99_us", "legacy_event_id_ns")
+# Tolerances per benchmark where single runs spread differently from --threshold:
+# memory repeats within ~2%; the tight loops (format, ids, publish_event) swing
+# 30-50% run to run with CPU boost and GC, so they only catch gross regressions
+TOLERANCES = {"idle_connection": 0.10, "format": 0.75, "ids": 0.75, "publish_event": 0.75}
+
+def regressions(current: dict, baseline: dict, threshold: float) -> tuple[list, list]:
+    """Rates (*_per_sec) regress when they drop; times and sizes when they grow. Returns (gated, ungated)."""
+    found, notes = [], []
+    for bench, metrics in baseline.items():
+        tolerance = TOLERANCES.get(bench, threshold)
+        for key, base in metrics.items():
+            cur = current.get(bench, {}).get(key)
+            if cur is None or not base:
+                continue
+            change = (cur - base) / base
+            worse = -change if key.endswith("_per_sec") else change
+            if key in UNGATED:
+                if worse > threshold:
+                    notes.append(f"{bench}.{key}: {base} -> {cur} ({change:+.0%})")
+            elif worse > tolerance:
+                found.append(f"{bench}.{key}: {base} -> {cur} ({change:+.0%}, allowed {tolerance:.0%})")
+    return found, notes
+
+def parse_args():
+    p = argparse.ArgumentParser(description="NotifyService in-process benchmark (fakeredis, no server)")
+    p.add_argument("--format-iterations", type=int, default=50000)
+    p.add_argument("--publish", type=int, default=3000, help="publish_event calls")
+    p.add_argument("--route", type=int, default=1000, help="publish route requests")
+    p.add_argument("--clients", type=int, default=500, help="fan-out streams")
+    p.add_argument("--events", type=int, default=50, help="fan-out events")
+    p.add_argument("--idle", type=int, default=1000, help="idle streams for the memory measurement")
+    p.add_argument("--repeat", type=int, default=5, help="Runs to take the median of")
+    p.add_argument("--save", help="Write results as a JSON baseline")
+    p.add_argument("--compare", help="Baseline JSON to compare against; exits 1 on regression")
+    p.add_argument("--threshold", type=float, default=0.35, help="Allowed relative regression (see TOLERANCES)")
+    return p.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    results = median_of([asyncio.run(run(args)) for _ in range(args.repeat)])
+    print(json.dumps(results, indent=2))
+    if args.save:
+        os.makedirs(os.path.dirname(os.path.abspath(args.save)), exist_ok=True)
+        with open(args.save, "w") as f:
+            json.dump({"python": platform.python_version(), "machine": platform.machine(), "results": results}, f, indent=2)
+            f.write("\n")
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["results"]
+        found, notes = regressions(results, baseline, args.threshold)
+        for line in notes:
+            print(f"note (not gated) {line}", file=sys.stderr)
+        for line in found:
+            print(f"REGRESSION {line}", file=sys.stderr)
+        sys.exit(1 if found else 0)
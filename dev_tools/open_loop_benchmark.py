@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+
+"""
+Open-loop load generator: publishers fire on a fixed timetable whatever the
+server does, and latency is measured from the *intended* send time, so a
+stalled server shows up as latency instead of as a lower send rate
+(coordinated omission). Publishers and SSE consumers run in separate
+processes and record into fixed-memory HDR histograms (dev_tools/hdr.py);
+each process ships interval histograms to the parent, which merges them.
+
+Reports, in ms:
+	•	publish_response: scheduled send -> response (includes queueing behind a slow server)
+	•	publish_service: actual send -> response (what a closed-loop client would report)
+	•	e2e: scheduled send -> event parsed by an SSE client
+
+Past ``--max-in-flight`` due sends queue and go out as requests complete,
+still timed from their scheduled time. Sends still queued when the run ends
+are recorded at the time waited so far and counted as ``skipped``; any skip
+makes the run invalid (the generator, not the server, was the bottleneck).
+
+End-to-end latency compares wall clocks across processes; run the generator
+on one host (or NTP-synced hosts).
+
+Example usage:
+``python open_loop_benchmark.py --base http://localhost:8000 --rps 5000 --duration 60 \\
+  --publish-procs 4 --sse-procs 4 --clients 2000 --users 2000 --jwt-secret dev-secret``
+"""
+
+import argparse, asyncio, json, multiprocessing as mp, queue, random, re, sys, time
+from collections import deque
+
+from hdr import Histogram
+from sse_benchmark import make_jwt, parse_sse_block
+
+PUB_TS = re.compile(r'"pub_ts":\s*([0-9.]+)')
+
+def _uvloop():
+    try:
+        import uvloop; uvloop.install()
+    except Exception:
+        pass
+
+# ---- publisher process ----
+async def _publish(args, index: int, start_at: float, out: mp.Queue):
+    import httpx
+    rate = args.rps / args.publish_procs
+    url = f"{args.base.rstrip('/')}/api/v1/internal/notify/publish"
+    user_ids = [str(u) for u in range(args.user_start, args.user_start + args.users)]
+    response, service = Histogram(), Histogram()
+    counters = {"sent": 0, "errors": 0, "queued": 0, "skipped": 0}
+    in_flight = 0
+    # (seq, intended) of due sends waiting for a free slot
+    backlog: deque = deque()
+    tasks = set()
+
+    def launch(client, seq: int, intended: float):
+        nonlocal in_flight
+        in_flight += 1
+        t = asyncio.create_task(send(client, seq, intended))
+        tasks.add(t); t.add_done_callback(tasks.discard)
+
+    async def send(client, seq: int, intended: float):
+        nonlocal in_flight
+        body = {"type": args.etype, "user_id": random.choice(user_ids), "data": {"seq": seq, "pub_ts": intended}}
+        began = time.time()
+        try:
+            res = await client.post(url, json=body)
+            ok = res.status_code == 202
+        except Exception:
+            ok = False
+        done = time.time()
+        in_flight -= 1
+        if backlog:
+            launch(client, *backlog.popleft())
+        if not ok:
+            counters["errors"] += 1
+            return
+        counters["sent"] += 1
+        response.record((done - intended) * 1e6)
+        service.record((done - began) * 1e6)
+
+    limits = httpx.Limits(max_connections=args.max_in_flight, max_keepalive_connections=args.max_in_flight)
+    async with httpx.AsyncClient(limits=limits, timeout=30.0) as client:
+        # stagger processes within one tick so they don't all fire together
+        interval = 1.0 / rate
+        next_send = start_at + index * interval / args.publish_procs
+        end_at = start_at + args.duration
+        next_report = start_at + args.report_every
+        seq = index
+        while next_send < end_at:
+            delay = next_send - time.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            # catch up on every send that is due; never drop the schedule
+            now = time.time()
+            while next_send <= now and next_send < end_at:
+                if in_flight >= args.max_in_flight:
+                    # latency still counts from next_send, so queueing shows up in the histogram
+                    counters["queued"] += 1
+                    backlog.append((seq, next_send))
+                else:
+                    launch(client, seq, next_send)
+                seq += args.publish_procs
+                next_send += interval
+            if now >= next_report:
+                out.put(("pub", index, dict(counters), response.to_dict(), service.to_dict(), False))
+                response.reset(); service.reset()
+                counters = dict.fromkeys(counters, 0)
+                next_report += args.report_every
+        deadline = time.time() + 30
+        while tasks and time.time() < deadline:
+            await asyncio.wait(set(tasks), timeout=deadline - time.time())
+        # never sent: record what they waited, rather than leaving the worst of the timetable out
+        now = time.time()
+        for _, intended in backlog:
+            counters["skipped"] += 1
+            response.record((now - intended) * 1e6)
+    out.put(("pub", index, counters, response.to_dict(), service.to_dict(), True))
+
+def publisher_proc(args, index: int, start_at: float, out: mp.Queue):
+    _uvloop()
+    asyncio.run(_publish(args, index, start_at, out))
+
+# ---- SSE consumer process ----
+async def _consume(args, index: int, start_at: float, out: mp.Queue):
+    import aiohttp
+    e2e = Histogram()
+    counters = {"events": 0, "disconnects": 0}
+    stop = asyncio.Event()
+    mine = range(index, args.clients, args.sse_procs)
+
+    async def client(session, user_id: str):
+        token = make_jwt(args.jwt_secret, args.jwt_alg, user_id, claim=args.jwt_claim, ttl=args.duration + 600)
+        url = f"{args.base.rstrip('/')}/api/v1/external/notify/stream?token={token}"
+        buf = ""
+        while not stop.is_set():
+            try:
+                async with session.get(url, headers={"Accept": "text/event-stream"}) as resp:
+                    async for raw in resp.content.iter_any():
+                        now = time.time()
+                        buf += raw.decode("utf-8", errors="ignore")
+                        while "\n\n" in buf:
+                            block, buf = buf.split("\n\n", 1)
+                            for (_, _, data) in parse_sse_block(block + "\n\n"):
+                                m = PUB_TS.search(data)
+                                if m:
+                                    counters["events"] += 1
+                                    e2e.record((now - float(m.group(1))) * 1e6)
+            except Exception:
+                pass
+            if not stop.is_set():
+                counters["disconnects"] += 1
+                await asyncio.sleep(1.0)
+
+    connector = aiohttp.TCPConnector(limit=0)
+    timeout = aiohttp.ClientTimeout(total=None, sock_read=None, sock_connect=30)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        tasks = [asyncio.create_task(client(session, str(args.user_start + i % args.users))) for i in mine]
+        next_report = start_at + args.report_every
+        end_at = start_at + args.duration + args.drain
+        while time.time() < end_at:
+            await asyncio.sleep(max(0.0, min(next_report, end_at) - time.time()))
+            if time.time() >= next_report:
+                out.put(("sse", index, dict(counters), e2e.to_dict(), None, False))
+                e2e.reset()
+                counters = dict.fromkeys(counters, 0)
+                next_report += args.report_every
+        stop.set()
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+    out.put(("sse", index, counters, e2e.to_dict(), None, True))
+
+def consumer_proc(args, index: int, start_at: float, out: mp.Queue):
+    _uvloop()
+    asyncio.run(_consume(args, index, start_at, out))
+
+# ---- parent ----
+def run(args):
+    out: mp.Queue = mp.Queue()
+    # consumers get a head start to connect before the first publish
+    start_at = time.time() + args.warmup
+    procs = [mp.Process(target=consumer_proc, args=(args, i, start_at, out), daemon=True) for i in range(args.sse_procs)]
+    procs += [mp.Process(target=publisher_proc, args=(args, i, start_at, out), daemon=True) for i in range(args.publish_procs)]
+    for p in procs:
+        p.start()
+
+    names = ("response", "service", "e2e")
+    total = {n: Histogram() for n in names}
+    interval = {n: Histogram() for n in names}
+    counts_total = {"sent": 0, "errors": 0, "queued": 0, "skipped": 0, "events": 0, "disconnects": 0}
+    counts_interval = dict(counts_total)
+    running = len(procs)
+    next_print = start_at + args.report_every + 0.5
+
+    def report(hists, counts, elapsed):
+        return {
+            "elapsed_sec": round(elapsed, 1),
+            "target_rps": args.rps,
+            "sent_rps": round(counts["sent"] / elapsed, 1) if elapsed else 0,
+            **counts,
+            "publish_response_ms": hists["response"].summary(),
+            "publish_service_ms": hists["service"].summary(),
+            "e2e_ms": hists["e2e"].summary(),
+        }
+
+    while running:
+        try:
+            kind, _, counters, first, second, done = out.get(timeout=0.5)
+        except queue.Empty:
+            counters = None
+        if counters is not None:
+            for key, value in counters.items():
+                counts_total[key] += value
+                counts_interval[key] += value
+            if kind == "pub":
+                for name, data in (("response", first), ("service", second)):
+                    h = Histogram.from_dict(data); total[name].merge(h); interval[name].merge(h)
+            else:
+                h = Histogram.from_dict(first); total["e2e"].merge(h); interval["e2e"].merge(h)
+            running -= done
+        if time.time() >= next_print:
+            print(json.dumps(report(interval, counts_interval, args.report_every)))
+            interval = {n: Histogram() for n in names}
+            counts_interval = dict.fromkeys(counts_interval, 0)
+            next_print += args.report_every
+
+    for p in procs:
+        p.join(timeout=5)
+    summary = report(total, counts_total, args.duration)
+    summary["valid"] = counts_total["skipped"] == 0
+    print(json.dumps({"summary": summary}, indent=2))
+    if not summary["valid"]:
+        print(f"INVALID RUN: {counts_total['skipped']} scheduled sends never went out; "
+              "raise --max-in-flight or --publish-procs", file=sys.stderr)
+        sys.exit(1)
+
+def parse_args():
+    p = argparse.ArgumentParser(description="NotifyService open-loop load generator (HDR histograms, multi-process)")
+    p.add_argument("--base", default="http://localhost:8000")
+    p.add_argument("--rps", type=float, default=1000.0, help="Total scheduled publishes per second")
+    p.add_argument("--duration", type=float, default=30.0)
+    p.add_argument("--publish-procs", type=int, default=2)
+    p.add_argument("--sse-procs", type=int, default=2)
+    p.add_argument("--clients", type=int, default=100, help="SSE clients across all consumer processes")
+    p.add_argument("--users", type=int, default=100, help="Target users; clients map onto them round-robin")
+    p.add_argument("--user-start", type=int, default=1)
+    p.add_argument("--etype", default="bench")
+    p.add_argument("--max-in-flight", type=int, default=1000, help="Per publisher process; sends beyond it queue (timed from their schedule)")
+    p.add_argument("--report-every", type=float, default=5.0)
+    p.add_argument("--warmup", type=float, default=3.0, help="Seconds for consumers to connect before publishing starts")
+    p.add_argument("--drain", type=float, default=2.0, help="Seconds consumers keep reading after the last publish")
+    p.add_argument("--jwt-secret", required=True)
+    p.add_argument("--jwt-alg", default="HS256")
+    p.add_argument("--jwt-claim", default="sub")
+    return p.parse_args()
+
+if __name__ == "__main__":
+    run(parse_args())
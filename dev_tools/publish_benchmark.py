@@ -5,6 +5,13 @@ Generates events to /api/v1/internal/notify/publish at a target rate.
 
 Example usage:
 ``python publish_benchmark.py --base http://localhost:8000 --users 100 --rps 1000 --duration 60 --concurrency 20``
+
+Batch endpoint (rps counts events, not requests):
+``python publish_benchmark.py --base http://localhost:8000 --users 500 --rps 20000 --duration 60 --concurrency 20 --batch-size 500``
+
+With RATE_LIMIT_* enabled on the server, the per-user limit must allow rps / users
+events per second (40 above) and the producer limit the full rps, or the excess
+is rejected with 429 and counted as errors.
 """
 
 import asyncio, json, random, time, argparse, os
@@ -13,45 +20,62 @@ import httpx
 def now_iso():
     return time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime())
 
-async def publisher(client: httpx.AsyncClient, url: str, user_ids, etype: str, persistent: bool, rps: float, duration: float, metrics: dict):
-    interval = 1.0 / rps if rps > 0 else 0
+def make_payload(uid: str, etype: str, persistent: bool, i: int) -> dict:
+    return {
+        "type": etype,
+        "user_id": uid,
+        "persistent": persistent,
+        "permalink": None,
+        "data": {
+            "seq": i,
+            "uid": uid,
+            # Include server-side measurable timestamp field for E2E latency
+            "pub_ts": time.time()
+        }
+    }
+
+async def publisher(client: httpx.AsyncClient, url: str, user_ids, etype: str, persistent: bool, rps: float, duration: float, metrics: dict, batch_size: int = 1):
+    # rps counts events; with batching each request carries batch_size of them
+    interval = batch_size / rps if rps > 0 else 0
     deadline = time.perf_counter() + duration if duration > 0 else float("inf")
     i = 0
     while time.perf_counter() < deadline:
-        i += 1
-        uid = random.choice(user_ids)
-        payload = {
-            "type": etype,
-            "user_id": uid,
-            "persistent": persistent,
-            "permalink": None,
-            "data": {
-                "seq": i,
-                "uid": uid,
-                # Include server-side measurable timestamp field for E2E latency
-                "pub_ts": time.time()
-            }
-        }
         try:
-            res = await client.post(url, json=payload, timeout=10.0)
-            if res.status_code == 202:
-                metrics["sent"] += 1
+            if batch_size > 1:
+                batch = []
+                for _ in range(batch_size):
+                    i += 1
+                    batch.append(make_payload(random.choice(user_ids), etype, persistent, i))
+                res = await client.post(url, json=batch, timeout=10.0)
+                if res.status_code == 202:
+                    body = res.json()
+                    metrics["sent"] += body["accepted"]
+                    metrics["errors"] += body["rejected"]
+                else:
+                    metrics["errors"] += batch_size
             else:
-                metrics["errors"] += 1
+                i += 1
+                res = await client.post(url, json=make_payload(random.choice(user_ids), etype, persistent, i), timeout=10.0)
+                if res.status_code == 202:
+                    metrics["sent"] += 1
+                else:
+                    metrics["errors"] += 1
         except Exception:
-            metrics["errors"] += 1
+            metrics["errors"] += batch_size
         if interval:
             await asyncio.sleep(interval)
 
 async def run(args):
     base = args.base.rstrip("/")
     url = f"{base}/api/v1/internal/notify/publish"
+    if args.batch_size > 1:
+        url += "/batch"
     limits = httpx.Limits(max_connections=args.concurrency * 2, max_keepalive_connections=args.concurrency * 2)
     async with httpx.AsyncClient(limits=limits, timeout=10.0) as client:
         metrics = {"sent": 0, "errors": 0}
         user_ids = [str(u) for u in range(args.user_start, args.user_start + args.users)]
         tasks = [
-            asyncio.create_task(publisher(client, url, user_ids, args.etype, args.persistent, args.rps/args.concurrency, args.duration, metrics))
+            asyncio.create_task(publisher(client, url, user_ids, args.etype, args.persistent, args.rps/args.concurrency, args.duration, metrics, args.batch_size))
             for _ in range(args.concurrency)
         ]
         t0 = time.perf_counter()
@@ -64,6 +88,7 @@ async def run(args):
                 "sent": metrics["sent"],
                 "errors": metrics["errors"],
                 "elapsed_sec": elapsed,
+                "batch_size": args.batch_size,
                 "achieved_rps": metrics["sent"]/elapsed
             }, indent=2))
 
@@ -77,6 +102,7 @@ def parse_args():
     p.add_argument("--rps", type=float, default=100.0, help="Total publish requests per second")
     p.add_argument("--duration", type=float, default=30.0, help="Test duration in seconds (0 = infinite)")
     p.add_argument("--concurrency", type=int, default=10, help="Concurrent publisher tasks")
+    p.add_argument("--batch-size", type=int, default=1, help="Events per request; >1 uses the batch endpoint")
     return p.parse_args()
 
 if __name__ == "__main__":
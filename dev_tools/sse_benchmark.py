@@ -1,14 +1,16 @@
 #!/usr/bin/env python3
 
 """
-Opens many SSE connections to /api/v1/external/notify/stream?token=... and measures:
+Opens many SSE connections to /api/v1/external/notify/stream?token=... (or
+WebSockets to /ws with ``--transport ws``) and measures:
 	•	connections opened/failed
 	•	events received per connection and in total
 	•	end-to-end latency (uses server envelope created_at or data.pub_ts if present)
+	•	server cost per connection (RSS and CPU from /metrics, with ``--metrics``)
 
 Example usage:
 ``python sse_benchmark.py --base http://localhost:8000 \
-  --connections 200 --user-start 1000 \
+  --connections 200 --user-start 1000 --transport ws --metrics \
   --jwt-secret dev-secret --jwt-alg HS256 --jwt-claim sub --jwt-ttl 3600``
 """
 
@@ -50,6 +52,28 @@ class ConnStats:
         self.disconnects = 0
         self.latencies = []
 
+def consume_text(stats: ConnStats, buf: str, s: str) -> str:
+    """Feeds received text through the SSE parser (WS messages carry the same framing); returns the leftover."""
+    stats.bytes += len(s); buf += s
+    while "\n\n" in buf:
+        block, buf = buf.split("\n\n", 1)
+        for (event, eid, data) in parse_sse_block(block + "\n\n"):
+            stats.events += 1
+            # E2E latency from created_at or data.pub_ts
+            try:
+                payload = json.loads(data)
+                lat = None
+                if "created_at" in payload:
+                    dt = datetime.fromisoformat(payload["created_at"].replace("Z", "+00:00"))
+                    lat = time.time() - dt.timestamp()
+                elif isinstance(payload.get("data"), dict) and "pub_ts" in payload["data"]:
+                    lat = time.time() - float(payload["data"]["pub_ts"])
+                if lat is not None and 0 <= lat < 3600:
+                    stats.latencies.append(lat)
+            except Exception:
+                pass
+    return buf
+
 async def sse_client(session: aiohttp.ClientSession, base: str, token: str, stats: ConnStats, stop_evt: asyncio.Event):
     url = f"{base.rstrip('/')}/api/v1/external/notify/stream?token={token}"
     headers = {"Accept": "text/event-stream"}
@@ -62,29 +86,36 @@ async def sse_client(session: aiohttp.ClientSession, base: str, token: str, stat
                     await asyncio.sleep(1.0); continue
                 async for raw in resp.content.iter_any():
                     if stop_evt.is_set(): break
-                    s = raw.decode("utf-8", errors="ignore")
-                    stats.bytes += len(s); buf += s
-                    while "\n\n" in buf:
-                        block, buf = buf.split("\n\n", 1)
-                        for (event, eid, data) in parse_sse_block(block + "\n"):
-                            stats.events += 1
-                            # E2E latency from created_at or data.pub_ts
-                            try:
-                                payload = json.loads(data)
-                                lat = None
-                                if "created_at" in payload:
-                                    dt = datetime.fromisoformat(payload["created_at"].replace("Z", "+00:00"))
-                                    lat = time.time() - dt.timestamp()
-                                elif isinstance(payload.get("data"), dict) and "pub_ts" in payload["data"]:
-                                    lat = time.time() - float(payload["data"]["pub_ts"])
-                                if lat is not None and 0 <= lat < 3600:
-                                    stats.latencies.append(lat)
-                            except Exception:
-                                pass
+                    buf = consume_text(stats, buf, raw.decode("utf-8", errors="ignore"))
         except Exception:
             stats.disconnects += 1
             await asyncio.sleep(1.0)
 
+async def ws_client(session: aiohttp.ClientSession, base: str, token: str, stats: ConnStats, stop_evt: asyncio.Event):
+    url = f"{base.rstrip('/')}/api/v1/external/notify/ws?token={token}"
+    buf = ""
+    while not stop_evt.is_set():
+        try:
+            async with session.ws_connect(url, heartbeat=None) as ws:
+                async for msg in ws:
+                    if stop_evt.is_set(): break
+                    if msg.type != aiohttp.WSMsgType.TEXT: break
+                    buf = consume_text(stats, buf, msg.data)
+            stats.disconnects += 1
+        except Exception:
+            stats.disconnects += 1
+            await asyncio.sleep(1.0)
+
+async def server_cost(session: aiohttp.ClientSession, base: str) -> dict:
+    """RSS and CPU seconds summed over every worker, from the Prometheus endpoint."""
+    totals = {"notify_process_resident_memory_bytes": 0.0, "notify_process_cpu_seconds_total": 0.0}
+    async with session.get(f"{base.rstrip('/')}/api/v1/notify/metrics") as resp:
+        for line in (await resp.text()).splitlines():
+            name, _, value = line.partition("{")
+            if name in totals:
+                totals[name] += float(value.rsplit(" ", 1)[1])
+    return {"rss": totals["notify_process_resident_memory_bytes"], "cpu": totals["notify_process_cpu_seconds_total"]}
+
 async def run(args):
     stop_evt = asyncio.Event()
     def handle_sig(*_): stop_evt.set()
@@ -97,11 +128,13 @@ async def run(args):
         # Per-user JWTs
         tokens = [make_jwt(args.jwt_secret, args.jwt_alg, uid, claim=args.jwt_claim, ttl=args.jwt_ttl) for uid in user_ids]
 
+        baseline = await server_cost(session, args.base) if args.metrics else None
+        client = ws_client if args.transport == "ws" else sse_client
         tasks = []
         stats_list = []
         for uid, tok in zip(user_ids, tokens):
             st = ConnStats(uid); stats_list.append(st)
-            tasks.append(asyncio.create_task(sse_client(session, args.base, tok, st, stop_evt)))
+            tasks.append(asyncio.create_task(client(session, args.base, tok, st, stop_evt)))
 
         t0 = time.perf_counter(); last_events = 0; last_bytes = 0
         try:
@@ -116,25 +149,37 @@ async def run(args):
                 ev_rate = (total_events - last_events) / args.report_every
                 by_rate = (total_bytes - last_bytes) / args.report_every
                 last_events, last_bytes = total_events, total_bytes
-                print(json.dumps({
+                report = {
                     "elapsed_sec": round(time.perf_counter()-t0,2),
+                    "transport": args.transport,
                     "connections": args.connections,
                     "events_total": total_events,
                     "events_per_sec": round(ev_rate,2),
                     "bytes_per_sec": int(by_rate),
                     "disconnects": total_disc,
                     "latency_sec": {"p50": round(p50,4), "p95": round(p95,4)}
-                }))
+                }
+                if baseline is not None:
+                    # deltas since before the connections opened; run the same load per transport to compare
+                    now = await server_cost(session, args.base)
+                    report["server"] = {
+                        "rss_bytes_per_conn": int((now["rss"] - baseline["rss"]) / args.connections),
+                        "cpu_ms_per_conn": round((now["cpu"] - baseline["cpu"]) * 1000 / args.connections, 3),
+                        "cpu_us_per_event": round((now["cpu"] - baseline["cpu"]) * 1e6 / total_events, 2) if total_events else None,
+                    }
+                print(json.dumps(report))
         finally:
             stop_evt.set()
             await asyncio.gather(*tasks, return_exceptions=True)
 
 def parse_args():
-    p = argparse.ArgumentParser(description="NotifyService SSE client benchmark (per-user JWTs)")
+    p = argparse.ArgumentParser(description="NotifyService SSE/WebSocket client benchmark (per-user JWTs)")
     p.add_argument("--base", default="http://localhost:8000")
     p.add_argument("--connections", type=int, default=100)
     p.add_argument("--user-start", type=int, default=1)
     p.add_argument("--report-every", type=float, default=5.0)
+    p.add_argument("--transport", choices=["sse", "ws"], default="sse")
+    p.add_argument("--metrics", action="store_true", help="Report server RSS/CPU per connection from /metrics (needs internal access)")
     # JWT args
     p.add_argument("--jwt-secret", required=True, help="Shared secret")
     p.add_argument("--jwt-alg", default="HS256", help="Algorithm (e.g., HS256)")
@@ -0,0 +1,105 @@
+import time
+
+from app.services.buffer import ConnectionBuffer, frame_header, stats, untag
+
+
+
+def _frame(stream_id: str, urgent: bool = False, event: str = "t", expires_ms: int | None = None) -> bytes:
+    return untag(frame_header(expires_ms, urgent) + f"id: {stream_id}\nevent: {event}\ndata: {{}}\n\n".encode())
+
+
+def _drain(buffer: ConnectionBuffer) -> list[bytes]:
+    frames = []
+    while (frame := buffer.get_nowait()) is not None:
+        frames.append(frame[4:frame.index(b"\n")])
+    return frames
+
+
+def test_urgent_frame_overtaking_pending_frames_keeps_cursor():
+    buffer = ConnectionBuffer(max_events=10, max_bytes=1 << 20, policy="drop_oldest")
+    buffer.put_nowait(_frame("1-0"))
+    buffer.put_nowait(_frame("2-0", urgent=True))
+
+    # the urgent frame goes first, but must not move Last-Event-ID past 1-0
+    assert buffer.get_nowait() == b"event: t\ndata: {}\n\n"
+    assert buffer.get_nowait().startswith(b"id: 1-0\n")
+
+
+def test_urgent_frame_without_pending_frames_keeps_its_id():
+    buffer = ConnectionBuffer(max_events=10, max_bytes=1 << 20, policy="drop_oldest")
+    buffer.put_nowait(_frame("2-0", urgent=True))
+    buffer.put_nowait(_frame("3-0"))
+
+    assert buffer.get_nowait().startswith(b"id: 2-0\n")
+    assert buffer.get_nowait().startswith(b"id: 3-0\n")
+
+
+def test_drop_oldest_discards_the_oldest_pending_frames():
+    buffer = ConnectionBuffer(max_events=2, max_bytes=1 << 20, policy="drop_oldest")
+    dropped = stats.dropped
+    for i in range(1, 5):
+        buffer.put_nowait(_frame(f"{i}-0"))
+
+    assert _drain(buffer) == [b"3-0", b"4-0"]
+    assert stats.dropped - dropped == 2
+
+
+def test_coalesce_discards_an_older_frame_of_the_same_type():
+    buffer = ConnectionBuffer(max_events=2, max_bytes=1 << 20, policy="coalesce")
+    coalesced, dropped = stats.coalesced, stats.dropped
+    buffer.put_nowait(_frame("1-0", event="a"))
+    buffer.put_nowait(_frame("2-0", event="b"))
+    buffer.put_nowait(_frame("3-0", event="b"))
+
+    assert _drain(buffer) == [b"1-0", b"3-0"]
+    # no older frame of type "c": falls back to dropping the oldest
+    buffer.put_nowait(_frame("4-0", event="a"))
+    buffer.put_nowait(_frame("5-0", event="b"))
+    buffer.put_nowait(_frame("6-0", event="c"))
+
+    assert _drain(buffer) == [b"5-0", b"6-0"]
+    assert (stats.coalesced - coalesced, stats.dropped - dropped) == (1, 1)
+
+
+def test_disconnect_closes_the_buffer_on_overflow():
+    buffer = ConnectionBuffer(max_events=2, max_bytes=1 << 20, policy="disconnect")
+    evicted = stats.evicted
+    for i in range(1, 4):
+        buffer.put_nowait(_frame(f"{i}-0"))
+
+    assert buffer.closed_reason == "overflow"
+    assert buffer.qsize() == 0 and buffer.get_nowait() is None
+    assert stats.evicted - evicted == 1
+
+
+def test_max_bytes_bounds_the_buffer():
+    frame = _frame("1-0")
+    buffer = ConnectionBuffer(max_events=100, max_bytes=2 * len(frame), policy="drop_oldest")
+    for i in range(1, 4):
+        buffer.put_nowait(_frame(f"{i}-0"))
+
+    assert _drain(buffer) == [b"2-0", b"3-0"]
+
+
+def test_expired_frames_are_not_delivered():
+    buffer = ConnectionBuffer(max_events=10, max_bytes=1 << 20, policy="drop_oldest")
+    expired = stats.expired
+    past_ms = int(time.time() * 1000) - 1000
+    buffer.put_nowait(_frame("1-0", expires_ms=past_ms))
+    buffer.put_nowait(_frame("2-0", expires_ms=past_ms + 3_600_000))
+
+    assert _drain(buffer) == [b"2-0"]
+    assert stats.expired - expired == 1
+
+
+def test_expired_frames_make_room_before_the_policy_applies():
+    buffer = ConnectionBuffer(max_events=2, max_bytes=1 << 20, policy="disconnect")
+    expired = stats.expired
+    buffer.put_nowait(_frame("1-0", expires_ms=int(time.time() * 1000) + 50))
+    buffer.put_nowait(_frame("2-0"))
+    time.sleep(0.06)
+    buffer.put_nowait(_frame("3-0"))
+
+    assert buffer.closed_reason is None
+    assert _drain(buffer) == [b"2-0", b"3-0"]
+    assert stats.expired - expired == 1
@@ -0,0 +1,56 @@
+import asyncio
+
+import pytest
+
+from app.api.v1.schemas import EventEnvelope
+from app.services.idempotency import IdempotencyCache, dedupe_key
+from app.services.pubsub import publish_event, user_channel, user_stream
+from app.services.shards import RedisShards
+from app.utils.ids import created_at_from_id, new_event_id
+
+fakeredis = pytest.importorskip("fakeredis")
+pytest.importorskip("lupa")  # fakeredis needs it for EVAL
+
+
+
+def _envelope() -> EventEnvelope:
+    event_id = new_event_id()
+    return EventEnvelope(id=event_id, type="t", user_id="1", data={}, created_at=created_at_from_id(event_id))
+
+
+def test_cache_returns_the_original_id_within_the_window(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("app.services.idempotency.time.time", lambda: now[0])
+    cache = IdempotencyCache(size=10, window_seconds=60)
+    cache.put("k", "first")
+
+    assert cache.get("k") == "first"
+    now[0] += 60
+    assert cache.get("k") is None
+
+
+def test_cache_evicts_the_least_recently_used_key():
+    cache = IdempotencyCache(size=2, window_seconds=60)
+    cache.put("a", "1")
+    cache.put("b", "2")
+    cache.get("a")
+    cache.put("c", "3")
+
+    assert cache.get("a") == "1"
+    assert cache.get("b") is None
+    assert cache.get("c") == "3"
+
+
+def test_duplicate_key_returns_the_original_id_from_redis():
+    async def run():
+        shards = RedisShards(["redis://localhost:6379/0"])
+        shards.clients = [fakeredis.FakeAsyncRedis()]
+        key = dedupe_key(user_channel("1"), "order-42")
+        first, retry = _envelope(), _envelope()
+
+        assert await publish_event(shards, first, dedupe=key) is None
+        assert await publish_event(shards, retry, dedupe=key) == first.id
+        # the retry published nothing
+        assert await shards.clients[0].xlen(user_stream("1")) == 1
+
+    asyncio.run(run())
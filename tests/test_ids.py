@@ -0,0 +1,46 @@
+from datetime import datetime, timezone
+
+from app.utils import ids
+from app.utils.ids import EventIdGenerator, MAX_SEQUENCE, created_at_from_id, encode_id, id_timestamp_ms
+
+
+
+NOW_MS = 1760000000123
+
+
+def _clock(monkeypatch, ms: int) -> None:
+    monkeypatch.setattr(ids.time, "time", lambda: ms / 1000)
+
+
+def test_ids_keep_increasing_when_the_clock_steps_back(monkeypatch):
+    gen = EventIdGenerator(worker=7)
+    _clock(monkeypatch, NOW_MS)
+    before = [gen.next_value() for _ in range(3)]
+    _clock(monkeypatch, NOW_MS - 5000)
+    after = [gen.next_value() for _ in range(3)]
+
+    values = before + after
+    assert values == sorted(set(values))
+    assert [encode_id(v) for v in values] == sorted(encode_id(v) for v in values)
+
+
+def test_sequence_rollover_borrows_the_next_millisecond(monkeypatch):
+    gen = EventIdGenerator(worker=1)
+    _clock(monkeypatch, NOW_MS)
+    values = [gen.next_value() for _ in range(MAX_SEQUENCE + 3)]
+
+    assert values == sorted(set(values))
+    stamps = [id_timestamp_ms(encode_id(v)) for v in values]
+    assert stamps[MAX_SEQUENCE] == NOW_MS
+    assert stamps[MAX_SEQUENCE + 1] == NOW_MS + 1
+
+
+def test_created_at_round_trips_through_the_id(monkeypatch):
+    _clock(monkeypatch, NOW_MS)
+    event_id = encode_id(EventIdGenerator(worker=3).next_value())
+
+    assert len(event_id) == 13
+    assert id_timestamp_ms(event_id) == NOW_MS
+    created = datetime.fromisoformat(created_at_from_id(event_id))
+    assert created == datetime.fromtimestamp(NOW_MS / 1000, timezone.utc)
+    assert created_at_from_id(event_id).endswith(".123+00:00")
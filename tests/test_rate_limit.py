@@ -0,0 +1,79 @@
+import asyncio
+
+import pytest
+import redis.asyncio as redis
+
+from app.services.rate_limit import RateLimiter, user_bucket
+
+fakeredis = pytest.importorskip("fakeredis")
+pytest.importorskip("lupa")  # fakeredis needs it for EVAL
+
+
+
+BUCKET = ("user", user_bucket("u1"))
+
+
+async def _tokens(r) -> float:
+    return float(await r.hget(BUCKET[1], "t"))
+
+
+def test_batch_is_leased_and_spent_locally():
+    async def run():
+        r = fakeredis.FakeAsyncRedis()
+        limiter = RateLimiter(r, {"user": (1, 100)}, batch=10)
+
+        assert await limiter.take({BUCKET: 1}) == {BUCKET: (1, 0.0)}
+        # one round trip took the whole batch: 1 used, 9 leased to this worker
+        assert 90 <= await _tokens(r) < 91
+        assert await limiter.take({BUCKET: 9}) == {BUCKET: (9, 0.0)}
+        assert 90 <= await _tokens(r) < 91
+        # lease spent: the next token comes from Redis again, with a new batch
+        assert await limiter.take({BUCKET: 1}) == {BUCKET: (1, 0.0)}
+        assert 80 <= await _tokens(r) < 81
+
+    asyncio.run(run())
+
+
+def test_large_burst_leases_one_percent():
+    async def run():
+        r = fakeredis.FakeAsyncRedis()
+        limiter = RateLimiter(r, {"producer": (1, 10000)}, batch=10)
+        key = ("producer", "rl:producer:p")
+
+        assert await limiter.take({key: 1}) == {key: (1, 0.0)}
+        assert 9900 <= float(await r.hget(key[1], "t")) < 9901
+
+    asyncio.run(run())
+
+
+def test_refusal_is_remembered_until_the_next_token():
+    async def run():
+        r = fakeredis.FakeAsyncRedis()
+        limiter = RateLimiter(r, {"user": (1, 2)}, batch=1)
+
+        granted, wait = (await limiter.take({BUCKET: 3}))[BUCKET]
+        assert granted == 2 and 0 < wait <= 1
+        # refused locally: the bucket in Redis is not touched
+        await r.delete(BUCKET[1])
+        granted, wait = (await limiter.take({BUCKET: 1}))[BUCKET]
+        assert granted == 0 and 0 < wait <= 1
+        assert not await r.exists(BUCKET[1])
+
+    asyncio.run(run())
+
+
+def test_kinds_without_a_limit_are_granted_in_full():
+    async def run():
+        limiter = RateLimiter(fakeredis.FakeAsyncRedis(), {"user": (0, 100)}, batch=10)
+        assert await limiter.take({BUCKET: 500}) == {BUCKET: (500, 0.0)}
+
+    asyncio.run(run())
+
+
+def test_redis_errors_fail_open():
+    async def run():
+        # nothing listens on port 1: every call fails with a connection error
+        limiter = RateLimiter(redis.Redis(port=1), {"user": (1, 2)}, batch=1)
+        assert await limiter.take({BUCKET: 5}) == {BUCKET: (5, 0.0)}
+
+    asyncio.run(run())
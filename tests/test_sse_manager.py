@@ -0,0 +1,27 @@
+from app.services.sse_manager import _skip_replayed
+
+
+
+def _frame(stream_id: str | None) -> bytes:
+    prefix = f"id: {stream_id}\n" if stream_id is not None else ""
+    return f"{prefix}event: t\ndata: {{}}\n\n".encode()
+
+
+def test_frames_up_to_the_replay_cursor_are_dropped():
+    frames = [_frame("5-0"), _frame("5-1")]
+
+    assert _skip_replayed(frames, (5, 1)) == ([], (5, 1))
+
+
+def test_first_frame_past_the_cursor_ends_the_skipping():
+    frames = [_frame("5-0"), _frame("5-1"), _frame("6-0"), _frame("5-0")]
+
+    # once caught up, later frames are kept whatever their id
+    assert _skip_replayed(frames, (5, 0)) == ([_frame("5-1"), _frame("6-0"), _frame("5-0")], None)
+
+
+def test_frames_without_an_id_are_kept_while_skipping():
+    frames = [_frame(None), _frame("5-0"), _frame(None)]
+
+    assert _skip_replayed(frames, (5, 0)) == ([_frame(None), _frame(None)], (5, 0))
+    assert _skip_replayed([_frame(None), _frame("7-0")], (5, 0)) == ([_frame(None), _frame("7-0")], None)